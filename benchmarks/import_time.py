@@ -0,0 +1,66 @@
+"""
+Measures how long it takes to import the connector package.
+
+Each module is imported in a fresh interpreter with '-X importtime', and
+the cumulative import time of the module is reported (best of N runs).
+
+    python benchmarks/import_time.py [module ...] [--runs N]
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+DEFAULT_MODULES = [
+    'rasa_middleware_connector',
+    'rasa_middleware_connector.connector',
+    'rasa_middleware_connector.resilience',
+]
+
+IMPORT_TIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)')
+
+
+def measure(module, runs):
+
+    best = None
+
+    for _ in range(runs):
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        )
+
+        imported = {}
+        for line in result.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                imported[match.group(4)] = int(match.group(2))
+
+        cumulative = imported.get(module, 0)
+        if best is None or cumulative < best[0]:
+            best = (cumulative, sorted(imported))
+
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=DEFAULT_MODULES)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        cumulative, imported = measure(module, args.runs)
+        rasa_loaded = any(name == 'rasa' or name.startswith('rasa.') for name in imported)
+
+        print('{:<45} {:>8.2f} ms  {:>4} modules  rasa imported: {}'.format(
+            module, cumulative / 1000, len(imported), 'yes' if rasa_loaded else 'no'
+        ))
+
+
+if __name__ == '__main__':
+    main()
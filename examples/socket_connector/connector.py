@@ -1,21 +1,62 @@
 import logging
 import asyncio
+import os
 
 from rasa.core.channels.channel import UserMessage
 from rasa.core.channels.socketio import SocketIOInput, SocketIOOutput
 
 from rasa_middleware_connector import InputMiddlewareConnector, OutputMiddlewareConnector
+from rasa_middleware_connector.profiling import PipelineProfiler
+from rasa_middleware_connector.recording import RecorderMiddleware, TrafficRecorder
+from rasa_middleware_connector.state import InMemoryStateBackend, SQLiteStateBackend
 from .custom_middlewares.message_collector import MessageCollector
-from .custom_middlewares.text_cleaner import TextCleaner
+from .custom_middlewares.text_cleaner import TextNormalizer
 
 logger = logging.getLogger(__name__)
 
+class SocketOutput(OutputMiddlewareConnector, SocketIOOutput):
+
+    """A socket.io output channel with middleware support."""
+
+    def __init__(self, recorder, *args, **kwargs):
+
+        self.recorder = recorder
+
+        super().__init__(*args, **kwargs)
+
+    def get_middlewares(self):
+
+        # records the bot responses on the same file as the incoming
+        # traffic, when recording is enabled
+        if self.recorder is None:
+            return []
+
+        return [RecorderMiddleware(self.recorder)]
+
+    def get_connector_class(self):
+
+        return SocketIOOutput
+
+
 class SocketInput(SocketIOInput, InputMiddlewareConnector):
 
     """A socket.io input channel with middleware support."""
 
     on_new_message = None
     sio = None
+    state_backend = None
+    recorder = None
+
+    # the MessageCollector merges the fragments on the envelope segments
+    use_message_envelope = True
+
+    # sends button payloads and commands straight to rasa, without
+    # waiting for the MessageCollector delay
+    use_priority_lanes = os.getenv('PRIORITY_LANES', 'false').lower() == 'true'
+
+    # messages held by the MessageCollector count on the bulk lane during
+    # the delay, so this is about the number of users typing at once
+    bulk_lane_concurrency = int(os.getenv('BULK_LANE_CONCURRENCY', 256))
 
     def get_middlewares(self):
 
@@ -25,11 +66,48 @@ class SocketInput(SocketIOInput, InputMiddlewareConnector):
 
         # if this list is empty, only 'on_new_message' will be called
         
-        return [
-            TextCleaner(),
-            MessageCollector(self)        
+        # the collector normalizes each message once, when it arrives,
+        # so there is no need for a TextCleaner before it
+        middlewares = [
+            MessageCollector(self, self.get_state_backend(), TextNormalizer())        
         ]
 
+        # records the incoming traffic when $RECORD_TRAFFIC_PATH is set,
+        # it can be replayed offline with replay_traffic.py
+        recorder = self.get_recorder()
+        if recorder is not None:
+            middlewares.insert(0, RecorderMiddleware(recorder))
+
+        return middlewares
+
+    def get_recorder(self):
+
+        # a single recorder is shared by the input and output channels,
+        # so both directions go to the same file in order
+
+        if self.recorder is None:
+            path = os.getenv('RECORD_TRAFFIC_PATH')
+
+            if path:
+                self.recorder = TrafficRecorder(path)
+
+        return self.recorder
+
+    def get_state_backend(self):
+
+        # workers that share the same $STATE_BACKEND_PATH share the
+        # collected messages, so no sticky routing is needed
+
+        if self.state_backend is None:
+            path = os.getenv('STATE_BACKEND_PATH')
+
+            if path:
+                self.state_backend = SQLiteStateBackend(path)
+            else:
+                self.state_backend = InMemoryStateBackend()
+
+        return self.state_backend
+
     def get_on_new_message(self):
 
         # returns the default rasa handler for messages
@@ -60,7 +138,9 @@ class SocketInput(SocketIOInput, InputMiddlewareConnector):
 
         text = data["message"]
 
-        output_channel = SocketIOOutput(self.sio, sender_id, self.bot_message_evt)
+        output_channel = SocketOutput(
+            self.get_recorder(), self.sio, sender_id, self.bot_message_evt
+        )
         message = UserMessage(
             text, output_channel, sid, input_channel=self.name()
         )
@@ -71,6 +151,13 @@ class SocketInput(SocketIOInput, InputMiddlewareConnector):
 
         self.on_new_message = on_new_message
 
+        # profiles one in every $PROFILE_SAMPLE_EVERY messages, send SIGUSR1
+        # to the process to log the samples
+        sample_every = os.getenv('PROFILE_SAMPLE_EVERY')
+        if sample_every:
+            self.profiler = PipelineProfiler(int(sample_every))
+            self.profiler.install_signal_handler()
+
         socketio_webhook = super().blueprint(on_new_message)
         self.sio = socketio_webhook.sio
 
@@ -1,10 +1,18 @@
 import logging
 import asyncio
+import itertools
+import time
 
 from asyncio import Lock
-from rasa.core.channels.channel import UserMessage
+from typing import TYPE_CHECKING
 
 from rasa_middleware_connector import BaseMiddleware
+from rasa_middleware_connector.envelope import MessageEnvelope
+from rasa_middleware_connector.lanes import hold_lane_tickets, lane_tickets, release_lane_tickets
+from rasa_middleware_connector.state import InMemoryStateBackend
+
+if TYPE_CHECKING:
+    from rasa.core.channels.channel import UserMessage
 
 logger = logging.getLogger(__name__)
 
@@ -13,22 +21,62 @@ class MessageCollector(BaseMiddleware):
     """
     Collects messages sent during a time periodo and combine them 
     into a single message.
+
+    The texts are kept on the state backend, so when several workers share 
+    a backend the messages of a user are combined even if they arrive on 
+    different workers. The time to send them (the end of the delay, moved 
+    by every new message) is kept on the backend too, so a worker only 
+    sends the messages when no worker received one during the delay.
+
+    With a 'normalizer' (like the TextNormalizer) each message is normalized 
+    and split into words once, when it arrives, and the combined message 
+    keeps the words in 'tokens'. In that case there is no need for a 
+    TextCleaner before the collector.
     """
     
     mutex = Lock()
     __on_new_message = None
 
-    def __init__(self, connector):
+    def __init__(self, connector, state_backend=None, normalizer=None):
         self.handlers = {}
         self.connector = connector
+        self.state_backend = state_backend or InMemoryStateBackend()
+        self.normalizer = normalizer
+
+        # the collector that replaced this one on a reload
+        self.successor = None
         
-    async def input_compute(self, message: UserMessage):
+    def transfer_state(self, previous):
+
+        # the pending handlers (and the ones the old chain still creates 
+        # for its in-flight messages) send trough this chain from now on,
+        # so nothing is left on the old chain after it drains
+        self.handlers = previous.handlers
+        previous.successor = self
+
+    async def input_compute(self, message: 'UserMessage'):
 
         logger.info("Middleware MessageCollector received message from {}".format(message.sender_id))
-                
-        await self.register_message(message, self.next)   
 
-    async def register_message(self, user_message: UserMessage, on_new_message):
+        # the message keeps its priority lane place until it is sent
+        hold_lane_tickets(message)
+
+        try:
+            await self.register_message(message, self.forward)
+        except Exception:
+            # the message was not kept, so nothing would release it
+            release_lane_tickets(message)
+            raise
+
+    async def forward(self, message: 'UserMessage'):
+
+        collector = self
+        while collector.successor is not None:
+            collector = collector.successor
+
+        await collector.next(message)
+
+    async def register_message(self, user_message: 'UserMessage', on_new_message):
         
         sid = user_message.sender_id
         
@@ -40,10 +88,20 @@ class MessageCollector(BaseMiddleware):
             except HandlerClosedException:
                 await self.create_handler(user_message, on_new_message)
 
-        else:
-            # skips delay on first message
+        elif await self.is_first_message(sid):
+            # no worker is holding messages from this user, skips the delay
             await self.create_handler(user_message, on_new_message, 0)
 
+        else:
+            # another worker may be holding messages from this user
+            await self.create_handler(user_message, on_new_message)
+
+    async def is_first_message(self, sid):
+
+        deadline = await self.state_backend.get(MessageHandler.DEADLINE_NAMESPACE, sid)
+
+        return deadline is None
+
     async def create_handler(self, user_message, on_new_message, delay=None):
         async with self.mutex:
 
@@ -51,13 +109,25 @@ class MessageCollector(BaseMiddleware):
 
             logger.info("Creating handler for: " + sid)
 
-            new_handler = MessageHandler(user_message, on_new_message, delay=delay)
+            new_handler = MessageHandler(
+                user_message, on_new_message, self.state_backend,
+                delay=delay, normalizer=self.normalizer
+            )
+
+            # only registered once its timer runs, a handler that failed 
+            # to start would never send the messages appended to it
+            await new_handler.start()
+
             self.handlers[sid] = new_handler
             
 
 class MessageHandler:
+
+    STATE_NAMESPACE = 'message_collector'
+    DEADLINE_NAMESPACE = 'message_collector_deadline'
     
-    def __init__(self, user_message: UserMessage, on_new_message, delay=None):
+    def __init__(self, user_message: 'UserMessage', on_new_message, state_backend,
+                 delay=None, normalizer=None):
         from os import getenv
 
         if delay is None:
@@ -68,6 +138,8 @@ class MessageHandler:
         self.messages = [user_message, ]
         self.sid = user_message.sender_id
         self.on_new_message = on_new_message
+        self.state_backend = state_backend
+        self.normalizer = normalizer
 
         self.mutex = Lock()
         self.reached_commit = False
@@ -81,30 +153,73 @@ class MessageHandler:
                 user_message.text
             )
         )
-        
-        self.timer = AsyncTimer(self.DELAY, self.commit)
+
+        self.timer = None
+
+    async def start(self):
+
+        async with self.mutex:
+            first_text = self.messages[0].text
+
+            if self.normalizer is not None:
+                fragment = self.normalizer.tokenize(first_text)
+            else:
+                fragment = first_text
+
+            await self.state_backend.append(self.STATE_NAMESPACE, self.sid, fragment)
+            await self.extend_deadline()
+            self.timer = AsyncTimer(self.DELAY, self.commit)
+
+    async def extend_deadline(self):
+
+        # written right away, the other workers check it before sending
+        try:
+            await self.state_backend.set_immediate(
+                self.DEADLINE_NAMESPACE, self.sid, time.time() + self.DELAY
+            )
+        except Exception:
+            # the messages are still sent when this handler's timer fires
+            logger.exception("Handler {} could not extend the deadline".format(self.sid))
+
+    async def clear_deadline(self):
+
+        # keeps a deadline moved by a message that arrived on another worker
+        # in the meantime
+        try:
+            deadline = await self.state_backend.get(self.DEADLINE_NAMESPACE, self.sid)
+
+            if deadline is not None and deadline <= time.time():
+                await self.state_backend.delete(self.DEADLINE_NAMESPACE, self.sid)
+        except Exception:
+            logger.exception("Handler {} could not clear the deadline".format(self.sid))
 
     def clean_ponctuation(self, text: str):
 
         return text.replace('.', '').replace(',', '').replace('!', '').replace('?', '')
 
-    async def append_message(self, user_message: UserMessage):
+    async def append_message(self, user_message: 'UserMessage'):
         
         async with self.mutex:
             if self.accepting is False:
                 raise HandlerClosedException()
 
-            user_message.text = self.clean_ponctuation(user_message.text)
+            if self.normalizer is not None:
+                # normalized once, the words are only joined on commit
+                fragment = self.normalizer.tokenize(user_message.text)
+            else:
+                user_message.text = self.clean_ponctuation(user_message.text)
+                fragment = user_message.text
 
+            await self.state_backend.append(self.STATE_NAMESPACE, self.sid, fragment)
+            await self.extend_deadline()
             self.messages.append(user_message)
             self.__reset_timer()
             
     def __reset_timer(self):
 
-        self.timer.cancel()
-        
         # if the commit has been reached, we shoud not reset the
-        # timer, or it will process the message twice
+        # timer, or it will process the message twice (nor cancel it,
+        # since the commit may be waiting for the lock)
         # there is no problem in not reseting the timer, since the message
         # added in this append operation will still be included
         # thats because the commit function awaits the lock that the funcion 
@@ -113,6 +228,7 @@ class MessageHandler:
         # to be processed will be alreadly included in the list
         if self.reached_commit is False:
             
+            self.timer.cancel()
             self.timer = AsyncTimer(self.DELAY, self.commit)
   
     async def commit(self):
@@ -125,23 +241,78 @@ class MessageHandler:
 
             logger.info("Handler {} acquired lock for commit".format(self.sid))
 
+            # another worker may have received a message after this 
+            # timer started, wait until the end of its delay
+            try:
+                deadline = await self.state_backend.get(self.DEADLINE_NAMESPACE, self.sid, 0)
+            except Exception:
+                # without the deadline the messages are sent now, instead 
+                # of leaving the handler without a timer
+                logger.exception("Handler {} could not read the deadline".format(self.sid))
+                deadline = 0
+
+            remaining = deadline - time.time()
+
+            if remaining > 0:
+                logger.info("Handler {} waiting {:.3f}s more".format(self.sid, remaining))
+                self.reached_commit = False
+                self.timer = AsyncTimer(remaining, self.commit)
+                return
+
             # close this Handler
             self.accepting = False
-            
-            # append all messages with a space in between
-            complete_text = self.messages[0].text
-            for msg in self.messages[1:]:
-                complete_text += ' ' + msg.text
 
-            final_message = self.messages[0]
-            final_message.text = complete_text
+            tickets = [ticket for message in self.messages for ticket in lane_tickets(message)]
+
+            try:
+                await self.__send(tickets)
+            finally:
+                # when the final message did not reach rasa (or another 
+                # worker sent the texts) the messages still leave their lanes
+                for ticket in tickets:
+                    ticket.release()
+
+    async def __send(self, tickets):
+        
+        # another worker may have sent the texts already
+        texts = await self.state_backend.pop_list(self.STATE_NAMESPACE, self.sid)
 
-            logger.info("Handler {} finished, sending final message '{}'".format(self.sid, complete_text))
+        await self.clear_deadline()
 
-            await self.on_new_message(final_message)
-            logger.info("Handler {} closed with messages: {}".format(self.sid, self.messages))
-                       
-            
+        if not texts:
+            logger.info("Handler {} has no messages left to send".format(self.sid))
+            return
+
+        # append all messages with a space in between
+        final_message = self.messages[0]
+
+        if self.normalizer is not None:
+            tokens = list(itertools.chain.from_iterable(texts))
+
+            if isinstance(final_message, MessageEnvelope):
+                final_message.set_tokens(tokens)
+            else:
+                final_message.text = ' '.join(tokens)
+
+        elif isinstance(final_message, MessageEnvelope):
+            # the segments are only joined when the text is read
+            final_message.text = texts[0]
+            final_message.extend_text(texts[1:])
+        else:
+            final_message.text = ' '.join(texts)
+
+        complete_text = final_message.text
+
+        logger.info("Handler {} finished, sending final message '{}'".format(self.sid, complete_text))
+
+        # released when the final message reaches rasa
+        if tickets:
+            final_message.lane_tickets = tickets
+
+        await self.on_new_message(final_message)
+        logger.info("Handler {} closed with messages: {}".format(self.sid, self.messages))
+                   
+        
 class AsyncTimer:
     def __init__(self, timeout, callback):
         self._timeout = timeout
@@ -150,7 +321,13 @@ class AsyncTimer:
 
     async def _job(self):
         await asyncio.sleep(self._timeout)
-        await self._callback()
+
+        try:
+            await self._callback()
+        except Exception:
+            # nobody awaits the timer, the error would only show up when
+            # the task is collected
+            logger.exception("Timer callback failed")
 
     def cancel(self):
         self._task.cancel()
@@ -1,19 +1,111 @@
 import asyncio
 import logging
+import re
 
-from rasa.core.channels.channel import UserMessage
+from typing import List, TYPE_CHECKING
 
 from rasa_middleware_connector import BaseMiddleware
 
+if TYPE_CHECKING:
+    from rasa.core.channels.channel import UserMessage
+
 logger = logging.getLogger(__name__)
 
+# each expression in a list is replaced by its key
+REPLACEMENTS = {
+    'a': ['à', 'á', 'ã', 'ä'],
+    'e': ['ê', 'ẽ', 'è', 'ë', 'eh', 'é'],
+    'i' : ['í', 'ì', 'î', 'ĩ'],
+    'o': ['ó', 'ò', 'õ', 'ö'],
+    'u': ['ú', 'ù', 'ũ', 'ü'],
+    'c': ['ç'],
+    'voce': ['vc'],
+    '': [','],
+    'tambem': ['tbm'],
+    'hoje': ['hj'],
+    'tudo': ['td'],
+    ' esta ': [' ta '],
+    ' para ': [' pra ']
+}
+
+PONCTUATION = ['.', ',', '!', '?']
+
+
+class TextNormalizer:
+
+    """
+    Applies all replacements to a text at once, instead of one 'replace' 
+    call per expression: single characters (accents and ponctuation) are 
+    replaced with one 'translate' call and the longer expressions with one 
+    compiled regular expression, so they also match after the accents are 
+    removed ('tá' becomes ' esta ').
+    """
+
+    def __init__(self, replacements=REPLACEMENTS, remove=PONCTUATION):
+
+        characters = {}
+        expressions = {}
+
+        for key, lst in replacements.items():
+            for c in lst:
+                if len(c) == 1:
+                    characters[c] = key
+                else:
+                    expressions[c] = key
+
+        for c in remove:
+            characters[c] = ''
+
+        self.characters = str.maketrans(characters)
+
+        # the spaces around expressions like ' ta ' are matched without
+        # being consumed, so 'pra ta' matches both ' pra ' and ' ta '
+        self.expressions = {}
+        patterns = []
+
+        # longer expressions first, so they win over their prefixes
+        for expression in sorted(expressions, key=len, reverse=True):
+            word = expression.strip(' ')
+            self.expressions[word] = expressions[expression].strip(' ')
+
+            pattern = re.escape(word)
+            if expression.startswith(' '):
+                pattern = '(?<= )' + pattern
+            if expression.endswith(' '):
+                pattern = pattern + '(?= )'
+
+            patterns.append(pattern)
+
+        # an empty pattern would match between every character
+        self.pattern = re.compile('|'.join(patterns)) if patterns else None
+
+    def normalize(self, text: str) -> str:
+
+        text = text.strip().lower().translate(self.characters)
+
+        if self.pattern is None:
+            return text
+
+        return self.pattern.sub(self._replace, text)
+
+    def tokenize(self, text: str) -> List[str]:
+
+        return self.normalize(text).split()
+
+    def _replace(self, match):
+
+        return self.expressions[match.group()]
+
+
 class TextCleaner(BaseMiddleware):
 
     """
     Cleans message from selected expressions.
     """
 
-    async def input_compute(self, message: UserMessage):
+    normalizer = TextNormalizer(remove=[])
+
+    async def input_compute(self, message: 'UserMessage'):
 
         logger.info("Middleware TextCleaner received message from {}".format(message.sender_id))
         
@@ -22,27 +114,4 @@ class TextCleaner(BaseMiddleware):
 
     def clean_message(self, text: str):
 
-        text = text.strip()
-        text = text.lower()
-
-        replacements = {
-            'a': ['à', 'á', 'ã', 'ä'],
-            'e': ['ê', 'ẽ', 'è', 'ë', 'eh', 'é'],
-            'i' : ['í', 'ì', 'î', 'ĩ'],
-            'o': ['ó', 'ò', 'õ', 'ö'],
-            'u': ['ú', 'ù', 'ũ', 'ü'],
-            'c': ['ç'],
-            'voce': ['vc'],
-            '': [','],
-            'tambem': ['tbm'],
-            'hoje': ['hj'],
-            'tudo': ['td'],
-            ' esta ': [' ta '],
-            ' para ': [' pra ']
-        }
-
-        for key, lst in replacements.items():
-            for c in lst:
-                text = text.replace(c, key)
-
-        return text
\ No newline at end of file
+        return self.normalizer.normalize(text)
@@ -1,19 +1,22 @@
 import asyncio
 import logging
-import requests
 import json
 import os
 
-from typing import Text, Dict, Any
-from rasa.core.channels.channel import UserMessage
+from typing import Text, Dict, Any, AsyncIterator, TYPE_CHECKING
 
 from rasa_middleware_connector import BaseMiddleware
+from rasa_middleware_connector.registry import LazyRegistry
+from rasa_middleware_connector.state import InMemoryStateBackend
+
+if TYPE_CHECKING:
+    from rasa.core.channels.channel import UserMessage
 
 logger = logging.getLogger(__name__)
 
 class Translator(BaseMiddleware):
 
-    language_map = None
+    # default engines of the translators created without 'translation_engines'
     translation_engines = None
 
     language_change_messages = {
@@ -23,25 +26,31 @@ class Translator(BaseMiddleware):
     }
 
 
-    def __init__(self, bot_language, *args, **kwargs):
+    def __init__(self, bot_language, state_backend=None, translation_engines=None, *args, **kwargs):
         self.bot_language = bot_language
-
-        if not Translator.language_map:
-            Translator.language_map = LanguageMap(bot_language)
-
-        if not Translator.translation_engines:
-            Translator.translation_engines = {
-                'en': GoogleTranslator,
-                'es': GoogleTranslator,
+        self.language_map = LanguageMap(bot_language, state_backend)
+
+        if translation_engines is None:
+            # maps user languages to the engine names in 'engine_registry'
+            # (or to engine classes)
+            translation_engines = type(self).translation_engines or {
+                'en': 'google',
+                'es': 'google',
             }
 
+        self.translation_engines = translation_engines
+
         self.avaliable_commands = {
             '/set_lang': self.command_set_lang
         }
 
         super().__init__(*args, **kwargs)
 
-    async def input_compute(self, message: UserMessage):
+    def transfer_state(self, previous):
+
+        self.language_map = previous.language_map
+
+    async def input_compute(self, message: 'UserMessage'):
 
         logger.info("Middleware Translator (Input) received message from {}".format(message.sender_id))
 
@@ -60,17 +69,24 @@ class Translator(BaseMiddleware):
 
         _, message['text'] = await self.translate(recipient_id, message['text'])
 
-        if message.get('buttons'):
-            buttons = []
-            for button in message['buttons']:
-                _, button['title'] = await  self.translate(recipient_id, button['title'])
-                buttons.append(button)
-                
-            message['buttons'] = buttons
+        # buttons are translated in place
+        for button in message.get('buttons') or ():
+            _, button['title'] = await self.translate(recipient_id, button['title'])
 
         await self.next(recipient_id, message)
 
-    async def commands(self, message: UserMessage):
+    async def output_stream_compute(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+
+        logger.info("Middleware Translator (Output stream) received chunks for {}".format(recipient_id))
+
+        async def translated_chunks():
+            async for chunk in chunks:
+                _, text = await self.translate(recipient_id, chunk)
+                yield text
+
+        await self.next_stream(recipient_id, translated_chunks())
+
+    async def commands(self, message: 'UserMessage'):
 
         args = message.text.split(' ')
 
@@ -81,64 +97,79 @@ class Translator(BaseMiddleware):
             await self.next(message)       
         
        
-    async def command_set_lang(self, message: UserMessage):
+    async def command_set_lang(self, message: 'UserMessage'):
         text = message.text
         args = text.split(' ')
 
         if len(args) < 2:
             logger.error("Error: no language passed. Doing nothing")
         else:
-            self.set_language(message.sender_id, args[1])
+            await self.set_language(message.sender_id, args[1])
             if args[1] in self.language_change_messages:
                 await message.output_channel.send_text_message(
                     message.sender_id,
                     self.language_change_messages[args[1]]
                 )
 
-    def set_language(self, id, user_language):
+    async def set_language(self, id, user_language):
 
         if len(user_language) > 6:
             logger.error('Language name is too big')
         else:
-            self.language_map.set_lang(id, user_language)
+            await self.language_map.set_lang(id, user_language)
 
 
     async def translate(self, id, text: str):
 
-        user_language = self.language_map.get_lang(id)
+        user_language = await self.language_map.get_lang(id)
 
         if user_language != self.bot_language:
 
             text = text.strip()
           
-            engine = self.translation_engines[user_language](
+            text = await self.run_engine(
+                self.translation_engines[user_language],
                 text,
                 (self.bot_language if self.is_output else user_language),
                 (user_language if self.is_output else self.bot_language),
             )
 
-            text = await engine.translate()
-
         return {'lang': user_language}, text
 
+    async def run_engine(self, engine, text: str, input_language, output_language):
+
+        # engines are given as a name on 'engine_registry' or as the 
+        # engine class itself
+        if isinstance(engine, str):
+            engine = engine_registry.get(engine)
+
+        # deadlines and fallbacks are left to a ResilientMiddleware
+        # wrapping the translator
+        engine = engine(text, input_language, output_language)
+
+        return await engine.translate()
+
 
 class LanguageMap:
 
-    def __init__(self, default_language):
+    STATE_NAMESPACE = 'language_map'
 
-        self.__conversations = {}
-        self.default_language = default_language
+    # used by the maps created without a backend, so the input and output
+    # translators of a process see the same languages
+    default_state_backend = InMemoryStateBackend()
 
-    def set_lang(self, id, language):
+    def __init__(self, default_language, state_backend=None):
+
+        self.state_backend = state_backend or self.default_state_backend
+        self.default_language = default_language
 
-        self.__conversations[id] = language
+    async def set_lang(self, id, language):
 
-    def get_lang(self, id):
+        await self.state_backend.set(self.STATE_NAMESPACE, id, language)
 
-        if id not in self.__conversations:
-            self.__conversations[id] = self.default_language
+    async def get_lang(self, id):
 
-        return self.__conversations[id]
+        return await self.state_backend.get(self.STATE_NAMESPACE, id, self.default_language)
 
 
 class TranslationEngine:
@@ -157,6 +188,14 @@ class TranslationEngine:
         raise NotImplementedError()
 
 
+    def post(self, url, parameters):
+
+        # requests is only needed by the http based engines
+        import requests
+
+        return requests.post(url, data = parameters)
+
+
 class ApertiumTranslator(TranslationEngine):
 
     def __init__(self, text, input_language, output_language):
@@ -181,7 +220,9 @@ class ApertiumTranslator(TranslationEngine):
         url = os.getenv('APERTIUM_URL', '')
         parameters = self.get_post_parameters()
 
-        response = requests.post(url, data = parameters)
+        response = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: self.post(url, parameters)
+        )
         text  = self.parse_response(response)
 
         return text
@@ -241,7 +282,9 @@ class YandexTranslator(TranslationEngine):
         url = os.getenv('YANDEX_URL', '')
         parameters = self.get_post_parameters()
 
-        response = requests.post(url, data = parameters)
+        response = await asyncio.get_event_loop().run_in_executor(
+            None, lambda: self.post(url, parameters)
+        )
         text  = self.parse_response(response)
 
         return text
@@ -288,12 +331,15 @@ class GoogleTranslator(TranslationEngine):
         super().__init__(*args, **kwargs)
 
     async def translate(self):
-        response = self.client.translate_text(
-            parent=self.parent,
-            contents=[self.text, ],
-            mime_type='text/html',
-            source_language_code=self.input_language,
-            target_language_code=self.output_language
+        response = await asyncio.get_event_loop().run_in_executor(
+            None,
+            lambda: self.client.translate_text(
+                parent=self.parent,
+                contents=[self.text, ],
+                mime_type='text/html',
+                source_language_code=self.input_language,
+                target_language_code=self.output_language
+            )
         )
 
         return self.parse_response(response)
@@ -314,4 +360,33 @@ class GoogleTranslator(TranslationEngine):
         for target, sub in substitutions.items():
             translated_text = translated_text.replace(target, sub)
 
-        return translated_text
\ No newline at end of file
+        return translated_text
+
+
+class FakeTranslator(TranslationEngine):
+
+    """
+    Stand-in engine for offline replays, it waits $FAKE_TRANSLATOR_DELAY 
+    seconds and returns the text unchanged.
+    """
+
+    async def translate(self):
+
+        await asyncio.sleep(float(os.getenv('FAKE_TRANSLATOR_DELAY', 0.2)))
+
+        return self.text
+
+
+# engines are only imported when a user language needs them, other
+# packages can add engines on the 'rasa_middleware_connector.translation_engines'
+# entry point group
+engine_registry = LazyRegistry(
+    'rasa_middleware_connector.translation_engines',
+    {
+        'google': __name__ + ':GoogleTranslator',
+        'apertium': __name__ + ':ApertiumTranslator',
+        'yandex': __name__ + ':YandexTranslator',
+        'apertium_yandex': __name__ + ':EN_PT_ApertiumYandexTranslator',
+        'fake': __name__ + ':FakeTranslator',
+    }
+)
@@ -0,0 +1,93 @@
+"""
+Replays traffic recorded by the RecorderMiddleware against fake Rasa and
+translation engines, and reports throughput and latency.
+
+Run from the repository root:
+
+    python -m examples.socket_connector.replay_traffic traffic.jsonl --speed 10
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+
+from collections import defaultdict
+
+from rasa_middleware_connector.recording import read_events
+from rasa_middleware_connector.replay import (
+    FakeAgent, ReplayInputConnector, ReplayOutputConnector, TrafficReplayer
+)
+
+from rasa_middleware_connector.state import InMemoryStateBackend
+
+from .custom_middlewares.message_collector import MessageCollector
+from .custom_middlewares.text_cleaner import TextNormalizer
+from .custom_middlewares.translator import Translator
+
+
+def build_parser():
+
+    parser = argparse.ArgumentParser(description='Replays recorded connector traffic.')
+    parser.add_argument('recording', help='file written by the RecorderMiddleware')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='replay speed multiplier, 0 replays as fast as possible')
+    parser.add_argument('--translator', action='store_true',
+                        help='adds a Translator (with a fake engine) before the collector '
+                             'and on the output, the example connectors have none')
+    parser.add_argument('--priority-lanes', action='store_true',
+                        help='same as $PRIORITY_LANES on the example SocketInput')
+    parser.add_argument('--bot-language', default='pt')
+    parser.add_argument('--rasa-delay', type=float, default=0.05,
+                        help='seconds the fake Rasa agent takes per message')
+    parser.add_argument('--translator-delay', type=float, default=0.2,
+                        help='seconds the fake translation engine takes per call')
+    parser.add_argument('--collector-delay', type=float, default=3.0,
+                        help='MessageCollector delay (DELAY_TIME)')
+
+    return parser
+
+
+async def run(args):
+
+    os.environ['FAKE_TRANSLATOR_DELAY'] = str(args.translator_delay)
+    os.environ['DELAY_TIME'] = str(args.collector_delay)
+
+    # the same middlewares as the example SocketInput and SocketOutput
+    # (without the recorder)
+    input_connector = ReplayInputConnector([], agent=FakeAgent(args.rasa_delay))
+    input_connector.middlewares.append(
+        MessageCollector(input_connector, InMemoryStateBackend(), TextNormalizer())
+    )
+    input_connector.use_message_envelope = True
+    input_connector.use_priority_lanes = args.priority_lanes
+
+    output_connector = ReplayOutputConnector([])
+
+    if args.translator:
+        # every user language is translated by the fake engine
+        fake_engines = defaultdict(lambda: 'fake')
+
+        input_connector.middlewares.insert(
+            0, Translator(args.bot_language, translation_engines=fake_engines)
+        )
+        output_connector.middlewares.append(
+            Translator(args.bot_language, translation_engines=fake_engines)
+        )
+
+    replayer = TrafficReplayer(input_connector, output_connector, speed=args.speed or None)
+    report = await replayer.replay(read_events(args.recording))
+
+    print(report)
+
+
+def main():
+
+    logging.basicConfig(level=logging.WARNING)
+
+    args = build_parser().parse_args()
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == '__main__':
+    main()
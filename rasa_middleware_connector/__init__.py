@@ -1,2 +1,40 @@
-from rasa_middleware_connector.connector import InputMiddlewareConnector, OutputMiddlewareConnector
-from rasa_middleware_connector.middleware import BaseMiddleware
+import importlib
+
+# the core classes do not import Rasa, so they are imported right away
+from .connector import InputMiddlewareConnector, OutputMiddlewareConnector
+from .middleware import BaseMiddleware
+
+# optional features and the modules that define them, imported on first
+# access so 'import rasa_middleware_connector' stays cheap
+_exports = {
+    'CircuitBreaker': 'rasa_middleware_connector.resilience',
+    'ResilientMiddleware': 'rasa_middleware_connector.resilience',
+    'LazyRegistry': 'rasa_middleware_connector.registry',
+    'SimpleUserMessage': 'rasa_middleware_connector.message',
+    'MessageEnvelope': 'rasa_middleware_connector.envelope',
+    'RecorderMiddleware': 'rasa_middleware_connector.recording',
+    'TrafficReplayer': 'rasa_middleware_connector.replay',
+    'StateBackend': 'rasa_middleware_connector.state',
+    'InMemoryStateBackend': 'rasa_middleware_connector.state',
+    'SQLiteStateBackend': 'rasa_middleware_connector.state',
+    'PipelineProfiler': 'rasa_middleware_connector.profiling',
+    'LaneMetrics': 'rasa_middleware_connector.lanes',
+}
+
+__all__ = ['InputMiddlewareConnector', 'OutputMiddlewareConnector', 'BaseMiddleware'] + list(_exports)
+
+
+def __getattr__(name):
+
+    if name not in _exports:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+    value = getattr(importlib.import_module(_exports[name]), name)
+    globals()[name] = value
+
+    return value
+
+
+def __dir__():
+
+    return sorted(set(globals()) | set(__all__))
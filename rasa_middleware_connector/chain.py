@@ -0,0 +1,100 @@
+import asyncio
+import logging
+
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class MiddlewareChain:
+
+    """
+    A linked list of middlewares, ready to process messages.
+
+    The chain counts the messages that are being processed on it, so a
+    connector can swap it for a new chain and wait for the messages that
+    were already running to finish on the old one.
+    """
+
+    def __init__(self, middlewares: List, entry: Optional[Callable] = None):
+
+        self.middlewares = middlewares
+
+        # the callable that starts the processment, usually the compute
+        # method of the first middleware
+        self.entry = entry or middlewares[0].compute
+
+        self.in_flight = 0
+        self.retired = False
+        self._drained = None
+
+    def enter(self):
+
+        self.in_flight += 1
+
+    def leave(self):
+
+        self.in_flight -= 1
+
+        if self.in_flight == 0 and self._drained is not None and not self._drained.done():
+            self._drained.set_result(None)
+
+    def retire(self):
+
+        """
+        Marks the chain as replaced, no new messages will be sent to it.
+        """
+
+        self.retired = True
+
+    async def wait_drained(self):
+
+        """
+        Waits for the messages that are being processed on the chain.
+        """
+
+        if self.in_flight == 0:
+            return
+
+        if self._drained is None:
+            self._drained = asyncio.get_event_loop().create_future()
+
+        await self._drained
+
+
+def unwrap(middleware):
+
+    """
+    Returns the middleware wrapped by a wrapper like 'ResilientMiddleware',
+    or the middleware itself.
+    """
+
+    return getattr(middleware, 'middleware', middleware)
+
+
+def transfer_states(previous_middlewares: List, middlewares: List):
+
+    """
+    Pairs each new middleware with the first unpaired previous middleware
+    of the same class and calls 'transfer_state' on it, so state like
+    collector handlers and caches survives a chain reload.
+
+    Wrapped middlewares are paired by the class of the middleware they
+    wrap. When only one of the pair is wrapped, the state is transferred
+    between the wrapped middlewares.
+    """
+
+    available = list(previous_middlewares)
+
+    for middleware in middlewares:
+        for previous in available:
+            if type(unwrap(previous)) is type(unwrap(middleware)):
+                available.remove(previous)
+
+                if type(previous) is not type(middleware):
+                    previous, middleware = unwrap(previous), unwrap(middleware)
+
+                if hasattr(middleware, 'transfer_state'):
+                    middleware.transfer_state(previous)
+
+                break
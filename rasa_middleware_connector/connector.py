@@ -1,13 +1,16 @@
 import logging
 import asyncio
-import uuid
-import time
-import re
 
-from rasa.core.channels.channel import UserMessage
-from typing import List, Callable, Text, Dict, Any
+from typing import List, Callable, Text, Dict, Any, AsyncIterator, TYPE_CHECKING
 
+from .chain import MiddlewareChain, transfer_states
+from .envelope import MessageEnvelope
+from .lanes import LaneMetrics, LaneTicket
 from .middleware import RasaDefaultPathMiddleware
+from .streaming import iterate_sentences
+
+if TYPE_CHECKING:
+    from rasa.core.channels.channel import UserMessage
 
 logger = logging.getLogger(__name__)
 
@@ -21,8 +24,13 @@ class MiddleWareConnector:
     INPUT_CONNECTOR_TYPE = 0
     OUTPUT_CONNECTOR_TYPE = 1
 
+    # a PipelineProfiler, set it before the middlewares are set up (or
+    # reload them) to profile a sample of the messages
+    profiler = None
+
     def __init__(self, *args, **kwargs):
         self.used_middlewares = []
+        self.chain = None
         self.middleware_is_ready = False
 
         super().__init__(*args, **kwargs)
@@ -43,6 +51,16 @@ class MiddleWareConnector:
 
         raise NotImplementedError()
 
+    def _get_default_stream_path(self):
+
+        """
+        Returns the callable wich is responsible to deliver a stream of 
+        output chunks to the channel. Only output connectors support 
+        streaming, so the default is None.
+        """
+
+        return None
+
     def get_middlewares(self) -> List:
         """
         This method should return a list with your middleware objects 
@@ -64,33 +82,138 @@ class MiddleWareConnector:
         the order of the list. Appens the default Rasa path to the end 
         of the middleware list. 
         """
+
+        self._use_chain(self.build_chain(self.get_middlewares()))
+
+    def build_chain(self, middlewares: List) -> MiddlewareChain:
+        """
+        Links the middlewares, followed by the default Rasa path, into a 
+        new chain.
+        """
+
         is_output = self._get_connector_type() == self.OUTPUT_CONNECTOR_TYPE
+        used_middlewares = []
         
         last = None
-        for middleware in self.get_middlewares():
+        for middleware in middlewares:
             
             if last is not None:
-                last.set_next(middleware.compute, is_output)
+                last.set_next(self._stage_compute(middleware), is_output)
+                last.set_next_stream(middleware.output_stream_compute)
 
             last = middleware
-            self.used_middlewares.append(middleware)
+            used_middlewares.append(middleware)
 
 
-        defualt_path_middleware = RasaDefaultPathMiddleware(self._get_default_path())
+        defualt_path_middleware = RasaDefaultPathMiddleware(
+            self._get_default_path(),
+            self._get_default_stream_path()
+        )
+        defualt_path_middleware.set_next(None, is_output)
 
-        if len(self.used_middlewares) > 0:
-            last.set_next(defualt_path_middleware, is_output)
+        if len(used_middlewares) > 0:
+            last.set_next(self._stage_compute(defualt_path_middleware), is_output)
+            last.set_next_stream(defualt_path_middleware.output_stream_compute)
         else:
-            self.used_middlewares = [defualt_path_middleware, ]
-    
+            used_middlewares = [defualt_path_middleware, ]
+
+        return MiddlewareChain(used_middlewares, self._stage_compute(used_middlewares[0]))
+
+    def _stage_compute(self, middleware):
+
+        if self.profiler is None:
+            return middleware.compute
+
+        return self.profiler.wrap_stage(type(middleware).__name__, middleware.compute)
+
+    def _use_chain(self, chain: MiddlewareChain):
+
+        # a single assignment, so messages always see a complete chain
+        self.chain = chain
+        self.used_middlewares = chain.middlewares
         self.middleware_is_ready = True
 
+    async def reload_middlewares(self, middlewares: List = None):
+        """
+        Swaps the middleware chain without dropping messages.
+
+        A new chain is built from 'middlewares' (or from get_middlewares 
+        when not given) and every new message is sent to it, while the 
+        messages already being processed finish on the old chain. State is 
+        carried from each old middleware to the new middleware of the same 
+        class trough 'transfer_state'. Returns when the old chain is done.
+
+        Middlewares that hold messages to send them later (like a collector) 
+        are not counted on the chain: their 'transfer_state' should make the 
+        held messages go to the new chain.
+        """
+
+        if middlewares is None:
+            middlewares = self.get_middlewares()
+
+        old_chain = self.chain
+        self._use_chain(self._rebuild_chain(old_chain, middlewares))
+
+        await self._retire_chain(old_chain)
+
+    def _rebuild_chain(self, old_chain: MiddlewareChain, middlewares: List) -> MiddlewareChain:
+
+        if old_chain is not None:
+            transfer_states(old_chain.middlewares, middlewares)
+
+        return self.build_chain(middlewares)
+
+    async def _retire_chain(self, old_chain: MiddlewareChain):
+
+        if old_chain is None:
+            return
+
+        old_chain.retire()
+
+        logger.info(
+            "Middlewares reloaded, waiting for {} messages on the old chain".format(
+                old_chain.in_flight
+            )
+        )
+
+        await old_chain.wait_drained()
+
     async def proccess_message(self, *args):
         """
         Starts the processment stage.
         """
 
-        await self.used_middlewares[0].compute(*args)
+        await self.run_chain(self.chain, *args)
+
+    async def run_chain(self, chain: MiddlewareChain, *args):
+        """
+        Sends a message trough the given chain.
+        """
+
+        chain.enter()
+
+        try:
+            profiler = self.profiler
+
+            if profiler is not None and profiler.should_sample():
+                await profiler.profile(chain.entry, *args)
+            else:
+                await chain.entry(*args)
+        finally:
+            chain.leave()
+
+    async def proccess_stream(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+        """
+        Starts the processment stage of a stream of output chunks.
+        """
+
+        chain = self.chain
+        chain.enter()
+
+        try:
+            await chain.middlewares[0].output_stream_compute(recipient_id, chunks)
+        finally:
+            chain.leave()
 
    
 class InputMiddlewareConnector(MiddleWareConnector):
@@ -100,8 +223,39 @@ class InputMiddlewareConnector(MiddleWareConnector):
 
     To instantiate this class you should implement 'get_middlewares', 
     'get_on_new_message' and 'create_user_message'.
+
+    Set 'use_message_envelope' to send the messages trough the middlewares 
+    as a MessageEnvelope instead of the UserMessage itself.
+
+    With 'use_priority_lanes' messages are classified in two lanes: 
+    payloads and commands (and short replies, up to 'fast_lane_max_length' 
+    characters) go to the fast lane, that only runs the middlewares from 
+    'get_fast_lane_middlewares'; every other message goes to the bulk lane, 
+    that runs the middlewares from 'get_middlewares' with at most 
+    'bulk_lane_concurrency' messages at a time. A message is on its lane 
+    (counted on the concurrency and the latency kept in 'lane_metrics') 
+    until it reaches Rasa, even when a middleware holds it to send it 
+    later. Fast messages are not ordered with the bulk messages of the 
+    same sender, a command can reach Rasa before a text sent earlier.
     """
 
+    FAST_LANE = 'fast'
+    BULK_LANE = 'bulk'
+
+    use_message_envelope = False
+
+    use_priority_lanes = False
+    fast_lane_max_length = 0
+    bulk_lane_concurrency = 16
+
+    # latency objectives, in seconds
+    fast_lane_slo = 0.1
+    bulk_lane_slo = 1.0
+
+    fast_chain = None
+    bulk_lane = None
+    lane_metrics = None
+
     def _get_connector_type(self):
         return self.INPUT_CONNECTOR_TYPE
 
@@ -119,7 +273,80 @@ class InputMiddlewareConnector(MiddleWareConnector):
 
         raise NotImplementedError()
 
-    def create_user_message(self, *args, **kwargs) -> UserMessage:
+    def get_fast_lane_middlewares(self) -> List:
+        """
+        Returns the middlewares for the fast lane, used when 
+        'use_priority_lanes' is set. They must be different objects from 
+        the ones returned by get_middlewares. 
+
+        The default is an empty list: fast messages are sent directly to 
+        Rasa. Include the middlewares that handle commands.
+        """
+
+        return []
+
+    def classify_message(self, message: 'UserMessage') -> Text:
+        """
+        Returns the lane of a message.
+        """
+
+        text = message.text or ''
+
+        if text.startswith('/'):
+            return self.FAST_LANE
+
+        if len(text) <= self.fast_lane_max_length:
+            return self.FAST_LANE
+
+        return self.BULK_LANE
+
+    def get_lane_metrics(self) -> List[Dict[Text, Any]]:
+        """
+        Returns the latency and SLO violations of each lane.
+        """
+
+        if self.lane_metrics is None:
+            return []
+
+        return [metrics.snapshot() for metrics in self.lane_metrics.values()]
+
+    def setup_middlewares(self):
+
+        super().setup_middlewares()
+
+        if self.use_priority_lanes:
+            self._setup_lanes()
+            self.fast_chain = self.build_chain(self.get_fast_lane_middlewares())
+
+    def _setup_lanes(self):
+
+        self.bulk_lane = asyncio.Semaphore(self.bulk_lane_concurrency)
+        self.lane_metrics = {
+            self.FAST_LANE: LaneMetrics(self.FAST_LANE, self.fast_lane_slo),
+            self.BULK_LANE: LaneMetrics(self.BULK_LANE, self.bulk_lane_slo),
+        }
+
+    async def reload_middlewares(self, middlewares: List = None, fast_lane_middlewares: List = None):
+
+        if not self.use_priority_lanes:
+            await super().reload_middlewares(middlewares)
+            return
+
+        if fast_lane_middlewares is None:
+            fast_lane_middlewares = self.get_fast_lane_middlewares()
+
+        if self.lane_metrics is None:
+            self._setup_lanes()
+
+        old_fast_chain = self.fast_chain
+        self.fast_chain = self._rebuild_chain(old_fast_chain, fast_lane_middlewares)
+
+        await asyncio.gather(
+            super().reload_middlewares(middlewares),
+            self._retire_chain(old_fast_chain)
+        )
+
+    def create_user_message(self, *args, **kwargs) -> 'UserMessage':
         """
         Returns a UserMessage object containing the text to be processed.
         """
@@ -131,15 +358,60 @@ class InputMiddlewareConnector(MiddleWareConnector):
         Method that handles a new message beeing sent to the connector.
         """
 
+        # get a UserMessage object from args passed
+        message = self.create_user_message(*args, **kwargs)
+
+        if message is None:
+            return
+
+        await self.receive_user_message(message)
+
+    async def receive_user_message(self, message: 'UserMessage'):
+        """
+        Sends a UserMessage that is already created to the middlewares.
+        """
+
         # setup middlewares it not ready
         if not self.middleware_is_ready:
             self.setup_middlewares()
 
-        # get a UserMessage object from args passed
-        message = self.create_user_message(*args, **kwargs)
-        
-        # sends UserMessage to middlewares
-        await self.proccess_message(message)
+        if self.use_message_envelope:
+            message = MessageEnvelope.from_user_message(message)
+
+        if not self.use_priority_lanes:
+            # sends UserMessage to middlewares
+            await self.proccess_message(message)
+            return
+
+        lane = self.classify_message(message)
+
+        if lane == self.FAST_LANE:
+            ticket = LaneTicket(self.lane_metrics[lane])
+        else:
+            ticket = LaneTicket(self.lane_metrics[lane], self.bulk_lane)
+
+        await ticket.acquire()
+
+        try:
+            # released when the message reaches Rasa
+            message.lane_tickets = [ticket]
+        except AttributeError:
+            pass
+
+        try:
+            if lane == self.FAST_LANE:
+                await self.run_chain(self.fast_chain, message)
+            else:
+                await self.proccess_message(message)
+        except BaseException:
+            # a message that failed is not held by anyone, even if a 
+            # middleware tried to hold it
+            ticket.release()
+            raise
+
+        # messages held by a middleware keep their place on the lane
+        if not ticket.held:
+            ticket.release()
 
 
 class OutputMiddlewareConnector(MiddleWareConnector):
@@ -150,6 +422,9 @@ class OutputMiddlewareConnector(MiddleWareConnector):
     def _get_default_path(self):
         return self.send_to_rasa
 
+    def _get_default_stream_path(self):
+        return self.send_stream_to_rasa
+
     def get_connector_class(self) -> type:
 
         """
@@ -166,8 +441,34 @@ class OutputMiddlewareConnector(MiddleWareConnector):
         
         await self.proccess_message(recipient_id, message)
 
+    async def send_response_stream(self, recipient_id: Text, chunks: AsyncIterator[Text]) -> None:
+        """
+        Sends a stream of text chunks trough the middlewares. Each chunk is 
+        delivered to the channel as soon as all middlewares processed it, 
+        instead of waiting for the complete answer.
+        """
+
+        if not self.middleware_is_ready:
+            self.setup_middlewares()
+
+        await self.proccess_stream(recipient_id, chunks)
+
+    async def send_text_response_stream(self, recipient_id: Text, text: Text) -> None:
+        """
+        Streams a complete text sentence by sentence.
+        """
+
+        await self.send_response_stream(recipient_id, iterate_sentences(text))
+
     async def send_to_rasa(self, recipient_id: Text, message: Dict[Text, Any]):
                
         connector_class = self.get_connector_class()
 
         await super(connector_class, self).send_response(recipient_id, message)
+
+    async def send_stream_to_rasa(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+
+        connector_class = self.get_connector_class()
+
+        async for chunk in chunks:
+            await super(connector_class, self).send_text_message(recipient_id, chunk)
@@ -0,0 +1,184 @@
+from typing import Any, Dict, Iterable, List, Optional, Text
+
+
+class MessageEnvelope:
+
+    """
+    Lightweight message carried by the input pipeline.
+
+    It has the same attributes as a UserMessage, so middlewares can use it
+    the same way, but:
+
+    * the text is kept as a list of segments that is only joined (with a
+      space) when 'text' is read, so merging fragments does not build
+      intermediate strings;
+    * the metadata is copy-on-write: it is shared with the original message
+      until a middleware changes a key with 'set_metadata', and copies of the
+      envelope share it too;
+    * stages that split the text (like a collector that normalizes the
+      fragments) can leave the words in 'tokens', so the following stages
+      do not split it again. Setting the text clears them.
+
+    The envelope is created from the UserMessage when the message enters the
+    connector and converted back right before it is sent to Rasa.
+    """
+
+    __slots__ = (
+        'segments', '_metadata', '_owns_metadata', 'output_channel', 'sender_id',
+        'parse_data', 'input_channel', 'message_id', 'source', 'tokens', 'lane_tickets'
+    )
+
+    SEPARATOR = ' '
+
+    def __init__(self, text: Optional[Text] = None, output_channel: Any = None,
+                 sender_id: Optional[Text] = None, parse_data: Optional[Dict[Text, Any]] = None,
+                 input_channel: Optional[Text] = None, message_id: Optional[Text] = None,
+                 metadata: Optional[Dict] = None, source: Any = None):
+
+        self.segments = [] if text is None else [text]
+        self._metadata = metadata
+        self._owns_metadata = False
+        self.output_channel = output_channel
+        self.sender_id = sender_id
+        self.parse_data = parse_data
+        self.input_channel = input_channel
+        self.message_id = message_id
+
+        # the UserMessage this envelope was created from
+        self.source = source
+        self.tokens = None
+        self.lane_tickets = None
+
+    @classmethod
+    def from_user_message(cls, message) -> 'MessageEnvelope':
+
+        return cls(
+            message.text,
+            message.output_channel,
+            message.sender_id,
+            getattr(message, 'parse_data', None),
+            getattr(message, 'input_channel', None),
+            getattr(message, 'message_id', None),
+            getattr(message, 'metadata', None),
+            source=message
+        )
+
+    def to_user_message(self):
+
+        """
+        Writes the envelope back to the UserMessage it came from, or creates
+        a new one if it was not created from a message.
+        """
+
+        message = self.source
+
+        if message is None:
+            message = new_user_message()
+
+        message.text = self.text
+        message.metadata = self._metadata
+        message.output_channel = self.output_channel
+        message.sender_id = self.sender_id
+        message.parse_data = self.parse_data
+        message.input_channel = self.input_channel
+        message.message_id = self.message_id
+
+        return message
+
+    @property
+    def text(self) -> Optional[Text]:
+
+        segments = self.segments
+
+        if not segments:
+            return None
+
+        if len(segments) > 1:
+            # join once and keep the result
+            segments[:] = [self.SEPARATOR.join(segments)]
+
+        return segments[0]
+
+    @text.setter
+    def text(self, text: Optional[Text]):
+
+        self.segments = [] if text is None else [text]
+        self.tokens = None
+
+    def set_tokens(self, tokens: List[Text]):
+
+        """
+        Sets the text from a list of words, keeping the list in 'tokens'.
+        """
+
+        self.segments = [self.SEPARATOR.join(tokens)]
+        self.tokens = tokens
+
+    def append_text(self, text: Text):
+
+        self.segments.append(text)
+        self.tokens = None
+
+    def extend_text(self, texts: Iterable[Text]):
+
+        self.segments.extend(texts)
+        self.tokens = None
+
+    @property
+    def metadata(self) -> Optional[Dict]:
+
+        """
+        The metadata may be shared with other messages, use 'set_metadata'
+        to change it.
+        """
+
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata: Optional[Dict]):
+
+        self._metadata = metadata
+        self._owns_metadata = True
+
+    def set_metadata(self, key: Text, value: Any):
+
+        if not self._owns_metadata:
+            self._metadata = dict(self._metadata or {})
+            self._owns_metadata = True
+
+        self._metadata[key] = value
+
+    def __copy__(self) -> 'MessageEnvelope':
+
+        envelope = MessageEnvelope.__new__(MessageEnvelope)
+
+        envelope.segments = list(self.segments)
+        envelope._metadata = self._metadata
+        envelope.output_channel = self.output_channel
+        envelope.sender_id = self.sender_id
+        envelope.parse_data = self.parse_data
+        envelope.input_channel = self.input_channel
+        envelope.message_id = self.message_id
+        envelope.source = self.source
+        envelope.tokens = None if self.tokens is None else list(self.tokens)
+        envelope.lane_tickets = self.lane_tickets
+
+        # both copies now share the metadata
+        envelope._owns_metadata = False
+        self._owns_metadata = False
+
+        return envelope
+
+    def __repr__(self):
+
+        return "MessageEnvelope(sender_id={!r}, text={!r})".format(self.sender_id, self.text)
+
+
+def new_user_message():
+
+    try:
+        from rasa.core.channels.channel import UserMessage
+    except ImportError:
+        from .message import SimpleUserMessage as UserMessage
+
+    return UserMessage()
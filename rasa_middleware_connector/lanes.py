@@ -0,0 +1,119 @@
+import time
+
+from collections import deque
+from typing import Any, Dict, List, Optional, Text
+
+
+class LaneMetrics:
+
+    """
+    Latency of the messages of a scheduling lane, compared to the lane
+    service level objective (SLO).
+
+    Keeps totals since the start and the last 'window' latencies, used to
+    compute percentiles.
+    """
+
+    def __init__(self, name: Text, slo: float, window: int = 1024):
+
+        self.name = name
+        self.slo = slo
+
+        self.count = 0
+        self.violations = 0
+        self.total = 0.0
+        self.latencies = deque(maxlen=window)
+
+    def observe(self, latency: float):
+
+        self.count += 1
+        self.total += latency
+        self.latencies.append(latency)
+
+        if latency > self.slo:
+            self.violations += 1
+
+    def percentile(self, percent: float) -> Optional[float]:
+
+        if not self.latencies:
+            return None
+
+        values = sorted(self.latencies)
+        index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+
+        return values[index]
+
+    def snapshot(self) -> Dict[Text, Any]:
+
+        return {
+            'lane': self.name,
+            'slo': self.slo,
+            'count': self.count,
+            'slo_violations': self.violations,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class LaneTicket:
+
+    """
+    A message's place on a lane, from when it enters the connector until
+    it reaches Rasa.
+
+    The ticket takes one of the lane 'slots' (a semaphore, if the lane
+    limits its concurrency) and, when released, gives it back and records
+    the latency on the lane metrics. It goes with the message in its
+    'lane_tickets' attribute and is released by the default Rasa path.
+    Middlewares that keep a message to send it later (like a collector)
+    call 'hold_lane_tickets', otherwise the ticket is released when the
+    message leaves the middlewares.
+    """
+
+    def __init__(self, metrics: LaneMetrics, slots=None):
+
+        self.metrics = metrics
+        self.slots = slots
+        self.start = time.monotonic()
+        self.held = False
+        self.released = False
+
+    async def acquire(self):
+
+        if self.slots is not None:
+            await self.slots.acquire()
+
+    def release(self):
+
+        if self.released:
+            return
+
+        self.released = True
+        self.metrics.observe(time.monotonic() - self.start)
+
+        if self.slots is not None:
+            self.slots.release()
+
+
+def lane_tickets(message) -> List[LaneTicket]:
+
+    return getattr(message, 'lane_tickets', None) or []
+
+
+def hold_lane_tickets(message):
+
+    """
+    Keeps the lane tickets of a message after it leaves the middlewares,
+    until it reaches Rasa or 'release_lane_tickets' is called.
+    """
+
+    for ticket in lane_tickets(message):
+        ticket.held = True
+
+
+def release_lane_tickets(message):
+
+    for ticket in lane_tickets(message):
+        ticket.release()
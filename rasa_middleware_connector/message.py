@@ -0,0 +1,34 @@
+from typing import Any, Dict, Optional, Text
+
+
+class SimpleUserMessage:
+
+    """
+    Minimal message with the same attributes as Rasa's UserMessage.
+
+    The middleware pipeline only relies on these attributes, so it can run
+    on this class in lightweight workers and tests without importing Rasa.
+    """
+
+    __slots__ = (
+        'text', 'output_channel', 'sender_id', 'parse_data',
+        'input_channel', 'message_id', 'metadata', 'lane_tickets'
+    )
+
+    def __init__(self, text: Optional[Text] = None, output_channel: Any = None,
+                 sender_id: Optional[Text] = None, parse_data: Optional[Dict[Text, Any]] = None,
+                 input_channel: Optional[Text] = None, message_id: Optional[Text] = None,
+                 metadata: Optional[Dict] = None):
+
+        self.text = text
+        self.output_channel = output_channel
+        self.sender_id = sender_id
+        self.parse_data = parse_data
+        self.input_channel = input_channel
+        self.message_id = message_id
+        self.metadata = metadata
+        self.lane_tickets = None
+
+    def __repr__(self):
+
+        return "SimpleUserMessage(sender_id={!r}, text={!r})".format(self.sender_id, self.text)
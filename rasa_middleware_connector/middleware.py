@@ -1,5 +1,10 @@
-from rasa.core.channels.channel import UserMessage
-from typing import Callable, Text, Any, Dict
+from typing import Callable, Text, Any, Dict, AsyncIterator, TYPE_CHECKING
+
+from .envelope import MessageEnvelope
+from .lanes import release_lane_tickets
+
+if TYPE_CHECKING:
+    from rasa.core.channels.channel import UserMessage
 
 class BaseMiddleware:
 
@@ -9,9 +14,10 @@ class BaseMiddleware:
 
     def __init__(self, *args, **kwargs):
         self.next = None
+        self.next_stream = None
         self.is_output = False
 
-    def set_next(self, next: Callable[[UserMessage], None], is_output):
+    def set_next(self, next: Callable[['UserMessage'], None], is_output):
 
         """
         Sets the next middleware to call.
@@ -20,6 +26,24 @@ class BaseMiddleware:
         self.next = next
         self.is_output = is_output
 
+    def set_next_stream(self, next_stream: Callable[[Text, AsyncIterator[Text]], None]):
+
+        """
+        Sets the next middleware to call when streaming output chunks.
+        """
+
+        self.next_stream = next_stream
+
+    def transfer_state(self, previous: 'BaseMiddleware'):
+
+        """
+        Called when the middleware chain is reloaded, with the middleware of 
+        the same class from the previous chain. Stateful middlewares should 
+        take over the state they need to keep (like caches) from 'previous'.
+        """
+
+        pass
+
     async def compute(self, *args):
         
         """
@@ -31,7 +55,7 @@ class BaseMiddleware:
         else:
             await self.input_compute(*args)
 
-    async def input_compute(self, message: UserMessage):
+    async def input_compute(self, message: 'UserMessage'):
 
         """
         This method process a input message, encapsulated in a UserMessage object 
@@ -52,17 +76,46 @@ class BaseMiddleware:
 
         raise NotImplementedError()
 
+    async def output_stream_compute(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+
+        """
+        This method process a stream of output text chunks (usually one 
+        sentence per chunk).
+
+        Chunks should be consumed lazily: wrap 'chunks' in a new async 
+        generator that yields the transformed chunks and call 
+        'await self.next_stream(recipient_id, new_chunks)'. This way each 
+        chunk reaches the channel as soon as every middleware is done with it.
+
+        The default implementation forwards the stream untouched.
+        """
+
+        await self.next_stream(recipient_id, chunks)
+
 
 class RasaDefaultPathMiddleware(BaseMiddleware):
 
-    def __init__(self, endpoint):
+    def __init__(self, endpoint, stream_endpoint=None):
+
+        super().__init__()
 
         self.endpoint = endpoint
+        self.stream_endpoint = stream_endpoint
 
     async def input_compute(self, message):
 
+        # the message (and the ones merged into it) leaves its lane
+        release_lane_tickets(message)
+
+        if isinstance(message, MessageEnvelope):
+            message = message.to_user_message()
+
         await self.endpoint(message)
 
     async def output_compute(self, recipient_id, message):
 
-        await self.endpoint(message)
\ No newline at end of file
+        await self.endpoint(recipient_id, message)
+
+    async def output_stream_compute(self, recipient_id, chunks):
+
+        await self.stream_endpoint(recipient_id, chunks)
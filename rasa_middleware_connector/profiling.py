@@ -0,0 +1,315 @@
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import time
+
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+# the stage being profiled on the current task
+_current_frame = contextvars.ContextVar('profiled_frame', default=None)
+
+
+class LoopLagProbe:
+
+    """
+    Measures the event loop lag: a callback is scheduled every 'interval'
+    seconds and the lag is how late it runs. It only runs while someone
+    called 'start' and not 'stop', and keeps the last 'size' measurements.
+    """
+
+    def __init__(self, interval: float = 0.005, size: int = 4096):
+
+        self.interval = interval
+        self.measurements = deque(maxlen=size)
+        self.users = 0
+        self.handle = None
+        self.due = None
+
+    def start(self):
+
+        self.users += 1
+
+        if self.handle is None:
+            self._schedule()
+
+    def stop(self):
+
+        # the callback that is already scheduled still runs, so the lag
+        # caused by the last stage is measured
+        self.users -= 1
+
+    def max_lag(self, start: float, end: float) -> Optional[float]:
+
+        """
+        Returns the largest lag of the callbacks that were due or waiting
+        between 'start' and 'end' (monotonic times).
+        """
+
+        lags = [lag for due, ran, lag in self.measurements if due <= end and ran >= start]
+
+        return max(lags) if lags else None
+
+    def _schedule(self):
+
+        self.due = time.monotonic() + self.interval
+        self.handle = asyncio.get_event_loop().call_later(self.interval, self._tick)
+
+    def _tick(self):
+
+        ran = time.monotonic()
+        self.measurements.append((self.due, ran, max(0.0, ran - self.due)))
+        self.handle = None
+
+        if self.users > 0:
+            self._schedule()
+
+
+class PipelineProfiler:
+
+    """
+    Profiles one in every 'sample_every' messages that go trough a
+    connector.
+
+    For each sampled message it records, per stage (middleware), the wall
+    and CPU time including and excluding the following stages, and the
+    largest event loop lag measured while the stage ran (by a probe
+    scheduled every 'probe_interval' seconds while stages are profiled).
+    Optionally it also records the top functions from cProfile and the top
+    allocations from tracemalloc. Samples go to a ring buffer with the last
+    'buffer_size' samples, read it with 'dump' or send the process a signal
+    after 'install_signal_handler'.
+
+    CPU time is measured on the thread, so it also counts other coroutines
+    that ran while the stage was waiting; the same goes for the loop lag,
+    cProfile and tracemalloc. Stages that run after the sample finished
+    (like the ones after the MessageCollector delay) are added to the
+    sample when they run.
+
+    Stages are only instrumented when the connector has a profiler when its
+    chain is built, so without a profiler there is no overhead. Errors of
+    the profiler itself are logged and never reach the message processing.
+    """
+
+    def __init__(self, sample_every: int = 100, buffer_size: int = 256,
+                 use_cprofile: bool = False, use_tracemalloc: bool = False, top: int = 10,
+                 probe_interval: float = 0.005):
+
+        self.sample_every = sample_every
+        self.use_cprofile = use_cprofile
+        self.use_tracemalloc = use_tracemalloc
+        self.top = top
+
+        self.samples = deque(maxlen=buffer_size)
+        self.count = 0
+        self.cprofile_running = False
+        self.probe = LoopLagProbe(probe_interval)
+
+        # samples using tracemalloc, it is stopped when the last one ends
+        self.tracemalloc_users = 0
+        self.tracemalloc_started = False
+
+    def should_sample(self) -> bool:
+
+        self.count += 1
+
+        return self.sample_every > 0 and self.count % self.sample_every == 0
+
+    def wrap_stage(self, name: Text, compute: Callable) -> Callable:
+
+        """
+        Returns 'compute' instrumented to record its timings on the current
+        sample.
+        """
+
+        async def profiled_stage(*args):
+
+            parent = _current_frame.get()
+
+            if parent is None:
+                await compute(*args)
+                return
+
+            stage = {'name': name, 'window': [time.monotonic(), None]}
+            parent['sample']['stages'].append(stage)
+
+            frame = {'sample': parent['sample'], 'children_wall': 0.0, 'children_cpu': 0.0}
+            token = _current_frame.set(frame)
+
+            probing = self._safely(self.probe.start) is not False
+
+            start_wall = time.perf_counter()
+            start_cpu = time.thread_time()
+
+            try:
+                await compute(*args)
+            finally:
+                wall = time.perf_counter() - start_wall
+                cpu = time.thread_time() - start_cpu
+                _current_frame.reset(token)
+
+                stage['window'][1] = time.monotonic()
+                stage['wall'] = wall
+                stage['cpu'] = cpu
+                stage['self_wall'] = wall - frame['children_wall']
+                stage['self_cpu'] = cpu - frame['children_cpu']
+
+                parent['children_wall'] += wall
+                parent['children_cpu'] += cpu
+
+                if probing:
+                    self.probe.stop()
+
+        return profiled_stage
+
+    async def profile(self, compute: Callable, *args):
+
+        """
+        Runs 'compute' as a sampled message.
+        """
+
+        sample = {'time': time.time(), 'stages': []}
+        frame = {'sample': sample, 'children_wall': 0.0, 'children_cpu': 0.0}
+        token = _current_frame.set(frame)
+
+        cprofile = self._safely(self._start_cprofile)
+        tracemalloc_before = self._safely(self._start_tracemalloc)
+
+        start_wall = time.perf_counter()
+        start_cpu = time.thread_time()
+
+        try:
+            await compute(*args)
+        finally:
+            sample['wall'] = time.perf_counter() - start_wall
+            sample['cpu'] = time.thread_time() - start_cpu
+            _current_frame.reset(token)
+
+            if cprofile:
+                sample['cprofile'] = self._safely(self._stop_cprofile, cprofile)
+
+            if tracemalloc_before:
+                sample['tracemalloc'] = self._safely(self._stop_tracemalloc, tracemalloc_before)
+
+            self.samples.append(sample)
+
+    def dump(self) -> List[Dict[Text, Any]]:
+
+        return [self._resolve_sample(sample) for sample in self.samples]
+
+    def _resolve_sample(self, sample: Dict[Text, Any]) -> Dict[Text, Any]:
+
+        # the lag is measured by callbacks that run after the stage, so it
+        # is only looked up when the samples are read
+        sample = dict(sample)
+        stages = []
+
+        for stage in sample['stages']:
+            stage = dict(stage)
+            start, end = stage.pop('window')
+            stage['loop_lag'] = self.probe.max_lag(start, end or time.monotonic())
+            stages.append(stage)
+
+        sample['stages'] = stages
+
+        return sample
+
+    def dump_json(self, path: Text):
+
+        with open(path, 'w', encoding='utf-8') as dump_file:
+            json.dump(self.dump(), dump_file, indent=2, default=str)
+
+    def install_signal_handler(self, signum: Optional[int] = None, path: Optional[Text] = None):
+
+        """
+        Dumps the samples when the process receives 'signum' (SIGUSR1 by
+        default): to 'path' as JSON, or to the log when no path is given.
+        """
+
+        import signal
+
+        if signum is None:
+            signum = signal.SIGUSR1
+
+        def handle_signal(*_):
+
+            if path:
+                self.dump_json(path)
+                logger.info("Profiling samples written to {}".format(path))
+            else:
+                logger.info("Profiling samples: {}".format(json.dumps(self.dump(), default=str)))
+
+        signal.signal(signum, handle_signal)
+
+    def _safely(self, function: Callable, *args):
+
+        try:
+            return function(*args)
+        except Exception:
+            logger.exception("Profiler failed, the message is processed without it")
+            return False
+
+    def _start_cprofile(self):
+
+        # only one cProfile can run at a time
+        if not self.use_cprofile or self.cprofile_running:
+            return None
+
+        import cProfile
+
+        cprofile = cProfile.Profile()
+        cprofile.enable()
+        self.cprofile_running = True
+
+        return cprofile
+
+    def _stop_cprofile(self, cprofile) -> Text:
+
+        import pstats
+
+        self.cprofile_running = False
+        cprofile.disable()
+
+        output = io.StringIO()
+        pstats.Stats(cprofile, stream=output).sort_stats('cumulative').print_stats(self.top)
+
+        return output.getvalue()
+
+    def _start_tracemalloc(self):
+
+        if not self.use_tracemalloc:
+            return None
+
+        import tracemalloc
+
+        # overlapping samples share the tracing, it is only stopped by the
+        # last one (and never when someone else started it)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.tracemalloc_started = True
+
+        snapshot = tracemalloc.take_snapshot()
+        self.tracemalloc_users += 1
+
+        return snapshot
+
+    def _stop_tracemalloc(self, before) -> List[Text]:
+
+        import tracemalloc
+
+        self.tracemalloc_users -= 1
+
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            if self.tracemalloc_users == 0 and self.tracemalloc_started:
+                tracemalloc.stop()
+                self.tracemalloc_started = False
+
+        stats = snapshot.compare_to(before, 'lineno')
+
+        return [str(stat) for stat in stats[:self.top]]
@@ -0,0 +1,176 @@
+import atexit
+import json
+import logging
+import time
+import uuid
+
+from typing import Any, AsyncIterator, Dict, Iterator, Text
+
+from .middleware import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# event keys, kept short since every message is written
+TIME = 't'
+DIRECTION = 'd'
+SENDER = 's'
+TEXT = 'x'
+METADATA = 'm'
+INPUT_CHANNEL = 'c'
+OUTPUT_MESSAGE = 'o'
+
+# streamed output: every chunk has the stream id and its index, and the
+# stream ends with an event without OUTPUT_MESSAGE
+STREAM = 'st'
+CHUNK = 'i'
+
+INBOUND = 'in'
+OUTBOUND = 'out'
+
+
+class TrafficRecorder:
+
+    """
+    Appends events to a JSON lines file.
+
+    Writes are buffered and flushed every 'flush_every' events (and when
+    the recorder is closed), so recording does not hit the disk for every
+    message. Recorders that are still open are closed when the process
+    exits.
+    """
+
+    def __init__(self, path: Text, buffer_size: int = 64 * 1024, flush_every: int = 100):
+
+        self.path = path
+        self.flush_every = flush_every
+        self.pending = 0
+
+        self.file = open(path, 'a', buffering=buffer_size, encoding='utf-8')
+
+        # writes the buffered events on shutdown
+        atexit.register(self.close)
+
+    def record(self, event: Dict[Text, Any]):
+
+        event[TIME] = time.time()
+
+        self.file.write(json.dumps(event, separators=(',', ':'), ensure_ascii=False, default=str))
+        self.file.write('\n')
+
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+
+        atexit.unregister(self.close)
+
+        if not self.file.closed:
+            self.file.close()
+
+
+class RecorderMiddleware(BaseMiddleware):
+
+    """
+    Records the traffic that goes trough the connector, so it can be
+    replayed offline later (see 'rasa_middleware_connector.replay').
+
+    Put it first on the middleware list to record the messages as they
+    arrive on the connector.
+    """
+
+    def __init__(self, recorder, *args, **kwargs):
+
+        if isinstance(recorder, str):
+            recorder = TrafficRecorder(recorder)
+
+        self.recorder = recorder
+
+        super().__init__(*args, **kwargs)
+
+    def transfer_state(self, previous):
+
+        if previous.recorder is self.recorder:
+            return
+
+        if previous.recorder.path == self.recorder.path:
+            # keeps the recorder that holds the buffered events, instead of
+            # a second file handle on the same file
+            self.recorder.close()
+            self.recorder = previous.recorder
+        else:
+            previous.recorder.flush()
+
+    async def input_compute(self, message):
+
+        self.recorder.record({
+            DIRECTION: INBOUND,
+            SENDER: message.sender_id,
+            TEXT: message.text,
+            METADATA: message.metadata,
+            INPUT_CHANNEL: message.input_channel,
+        })
+
+        await self.next(message)
+
+    async def output_compute(self, recipient_id: Text, message: Dict[Text, Any]):
+
+        self.recorder.record({
+            DIRECTION: OUTBOUND,
+            SENDER: recipient_id,
+            OUTPUT_MESSAGE: message,
+        })
+
+        await self.next(recipient_id, message)
+
+    async def output_stream_compute(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+
+        stream_id = uuid.uuid4().hex
+
+        async def recorded_chunks():
+            index = 0
+
+            async for chunk in chunks:
+                self.recorder.record({
+                    DIRECTION: OUTBOUND,
+                    SENDER: recipient_id,
+                    OUTPUT_MESSAGE: {'text': chunk},
+                    STREAM: stream_id,
+                    CHUNK: index,
+                })
+                index += 1
+                yield chunk
+
+            self.recorder.record({
+                DIRECTION: OUTBOUND,
+                SENDER: recipient_id,
+                STREAM: stream_id,
+                CHUNK: index,
+            })
+
+        await self.next_stream(recipient_id, recorded_chunks())
+
+
+def read_events(path: Text) -> Iterator[Dict[Text, Any]]:
+
+    """
+    Reads the events of a recording, in order.
+    """
+
+    with open(path, encoding='utf-8') as recording:
+        for line in recording:
+            line = line.strip()
+
+            if not line:
+                continue
+
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # the last line may be incomplete if the process was killed
+                logger.warning("Skipping invalid recorded event")
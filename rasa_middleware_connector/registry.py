@@ -0,0 +1,102 @@
+import importlib
+import logging
+
+from typing import Any, Dict, Optional, Text
+
+logger = logging.getLogger(__name__)
+
+
+class LazyRegistry:
+
+    """
+    Maps names to objects that are only imported when first used.
+
+    Targets are either the object itself or an import path in the
+    'package.module:attribute' format. When an entry point group is given,
+    the installed entry points of that group are also available by name
+    (they are only loaded when requested too).
+    """
+
+    def __init__(self, entry_point_group: Optional[Text] = None, targets: Optional[Dict[Text, Any]] = None):
+
+        self.entry_point_group = entry_point_group
+        self._targets = dict(targets or {})
+        self._loaded = {}
+        self._entry_points = None
+
+    def register(self, name: Text, target: Any):
+
+        """
+        Registers a target, replacing any previous target with the same name.
+        """
+
+        self._targets[name] = target
+        self._loaded.pop(name, None)
+
+    def get(self, name: Text) -> Any:
+
+        if name in self._loaded:
+            return self._loaded[name]
+
+        if name in self._targets:
+            target = self._targets[name]
+            loaded = import_string(target) if isinstance(target, str) else target
+        else:
+            entry_point = self._get_entry_points().get(name)
+
+            if entry_point is None:
+                raise KeyError("Nothing registered as '{}'".format(name))
+
+            loaded = entry_point.load()
+
+        logger.debug("Registry loaded '{}'".format(name))
+        self._loaded[name] = loaded
+
+        return loaded
+
+    def __contains__(self, name: Text) -> bool:
+
+        return name in self._targets or name in self._get_entry_points()
+
+    def _get_entry_points(self) -> Dict[Text, Any]:
+
+        if self._entry_points is None:
+            self._entry_points = {}
+
+            if self.entry_point_group is not None:
+                for entry_point in find_entry_points(self.entry_point_group):
+                    self._entry_points.setdefault(entry_point.name, entry_point)
+
+        return self._entry_points
+
+
+def import_string(path: Text) -> Any:
+
+    """
+    Imports an object from a 'package.module:attribute' path.
+    """
+
+    module_name, _, attribute = path.partition(':')
+    module = importlib.import_module(module_name)
+
+    if not attribute:
+        return module
+
+    return getattr(module, attribute)
+
+
+def find_entry_points(group: Text):
+
+    try:
+        from importlib import metadata
+    except ImportError:
+        # python < 3.8
+        import pkg_resources
+        return list(pkg_resources.iter_entry_points(group))
+
+    entry_points = metadata.entry_points()
+
+    if hasattr(entry_points, 'select'):
+        return list(entry_points.select(group=group))
+
+    return list(entry_points.get(group, []))
@@ -0,0 +1,381 @@
+import asyncio
+import logging
+import time
+
+from collections import defaultdict, deque
+from typing import Any, Dict, Iterable, List, Optional, Text
+
+from .connector import InputMiddlewareConnector, OutputMiddlewareConnector
+from .message import SimpleUserMessage
+from .recording import (
+    DIRECTION, INBOUND, INPUT_CHANNEL, METADATA, OUTBOUND, OUTPUT_MESSAGE,
+    SENDER, STREAM, TEXT, TIME
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FakeOutputChannel:
+
+    """
+    Output channel that only counts the messages sent to users.
+    """
+
+    def __init__(self):
+
+        self.sent = 0
+
+    @classmethod
+    def name(cls):
+
+        return 'replay'
+
+    async def send_response(self, recipient_id: Text, message: Dict[Text, Any]):
+
+        self.sent += 1
+
+    async def send_text_message(self, recipient_id: Text, text: Text, **kwargs: Any):
+
+        self.sent += 1
+
+
+class FakeAgent:
+
+    """
+    Stand-in for the Rasa agent 'handle_message', it takes 'delay' seconds
+    to handle each message and tells the replayer when a message arrived.
+    """
+
+    def __init__(self, delay: float = 0.0):
+
+        self.delay = delay
+        self.on_arrival = None
+
+    async def __call__(self, message):
+
+        if self.on_arrival is not None:
+            self.on_arrival(message.sender_id)
+
+        if self.delay:
+            await asyncio.sleep(self.delay)
+
+
+class ReplayInputConnector(InputMiddlewareConnector):
+
+    """
+    Input connector that runs the given middlewares against a FakeAgent.
+    """
+
+    def __init__(self, middlewares: List, agent: Optional[FakeAgent] = None):
+
+        self.middlewares = middlewares
+        self.agent = agent or FakeAgent()
+        self.output_channel = FakeOutputChannel()
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_on_new_message(self):
+
+        return self.agent
+
+    def create_user_message(self, event: Dict[Text, Any]):
+
+        return SimpleUserMessage(
+            event.get(TEXT),
+            self.output_channel,
+            event.get(SENDER),
+            input_channel=event.get(INPUT_CHANNEL),
+            metadata=event.get(METADATA)
+        )
+
+
+class ReplayOutputConnector(OutputMiddlewareConnector, FakeOutputChannel):
+
+    """
+    Output connector that runs the given middlewares and delivers the
+    result to a FakeOutputChannel.
+    """
+
+    def __init__(self, middlewares: List):
+
+        self.middlewares = middlewares
+        self.on_arrival = None
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_connector_class(self):
+
+        # 'super(OutputMiddlewareConnector, self)' resolves to the fake channel
+        return OutputMiddlewareConnector
+
+    async def send_to_rasa(self, recipient_id, message):
+
+        if self.on_arrival is not None:
+            self.on_arrival(recipient_id)
+
+        await super().send_to_rasa(recipient_id, message)
+
+    async def send_stream_to_rasa(self, recipient_id, chunks):
+
+        async def arriving_chunks():
+            # a stream arrives with its first chunk
+            arrived = False
+
+            async for chunk in chunks:
+                if not arrived and self.on_arrival is not None:
+                    self.on_arrival(recipient_id)
+                    arrived = True
+
+                yield chunk
+
+        await super().send_stream_to_rasa(recipient_id, arriving_chunks())
+
+
+class ReplayReport:
+
+    def __init__(self, events: int, duration: float, latencies: Dict[Text, List[float]],
+                 undelivered: Dict[Text, int]):
+
+        self.events = events
+        self.duration = duration
+        self.latencies = latencies
+        self.undelivered = undelivered
+
+    @property
+    def throughput(self) -> float:
+
+        return self.events / self.duration if self.duration else 0.0
+
+    def percentile(self, direction: Text, percent: float) -> Optional[float]:
+
+        values = sorted(self.latencies.get(direction, []))
+
+        if not values:
+            return None
+
+        index = min(len(values) - 1, int(round(percent / 100 * (len(values) - 1))))
+        return values[index]
+
+    def __str__(self):
+
+        lines = [
+            "Replayed {} events in {:.3f}s ({:.1f} events/s)".format(
+                self.events, self.duration, self.throughput
+            )
+        ]
+
+        for direction in (INBOUND, OUTBOUND):
+            values = self.latencies.get(direction, [])
+
+            if not values and not self.undelivered.get(direction):
+                continue
+
+            lines.append(
+                "{:<4} delivered: {:>6}  undelivered: {:>6}  "
+                "p50: {}  p95: {}  p99: {}  max: {}".format(
+                    direction,
+                    len(values),
+                    self.undelivered.get(direction, 0),
+                    *(format_ms(self.percentile(direction, p)) for p in (50, 95, 99, 100))
+                )
+            )
+
+        return '\n'.join(lines)
+
+
+def format_ms(value: Optional[float]) -> Text:
+
+    return '-' if value is None else '{:.1f}ms'.format(value * 1000)
+
+
+class TrafficReplayer:
+
+    """
+    Feeds recorded events back trough connectors and measures how long each
+    message takes to get trough the middlewares.
+
+    Inbound events go to the input connector and outbound events to the
+    output connector (events without a connector are ignored). 'speed'
+    scales the recorded time between events: 1.0 replays at the recorded
+    pace, 10.0 ten times faster and None as fast as possible.
+
+    Since middlewares like the MessageCollector merge messages, a delivered
+    message settles every pending message of the same sender, and its
+    latency is counted from the oldest of them.
+
+    Recorded streams are replayed as streams (with 'send_response_stream'),
+    each chunk at its recorded time. A stream counts as one event, and its
+    latency is the time until its first chunk is delivered.
+    """
+
+    def __init__(self, input_connector: Optional[ReplayInputConnector] = None,
+                 output_connector: Optional[ReplayOutputConnector] = None,
+                 speed: Optional[float] = 1.0, drain_timeout: float = 10.0):
+
+        self.input_connector = input_connector
+        self.output_connector = output_connector
+        self.speed = speed
+        self.drain_timeout = drain_timeout
+
+        self.pending = {INBOUND: defaultdict(deque), OUTBOUND: defaultdict(deque)}
+        self.latencies = {INBOUND: [], OUTBOUND: []}
+
+        # chunk queues of the streams being replayed, by stream id
+        self.streams = {}
+
+        if input_connector is not None:
+            input_connector.agent.on_arrival = self.arrival_handler(INBOUND)
+
+        if output_connector is not None:
+            output_connector.on_arrival = self.arrival_handler(OUTBOUND)
+
+    def arrival_handler(self, direction: Text):
+
+        def on_arrival(sender_id):
+
+            pending = self.pending[direction].pop(sender_id, None)
+
+            if pending:
+                self.latencies[direction].append(time.monotonic() - pending[0])
+
+        return on_arrival
+
+    async def replay(self, events: Iterable[Dict[Text, Any]]) -> ReplayReport:
+
+        tasks = []
+        count = 0
+        first_time = None
+        start = time.monotonic()
+
+        for event in events:
+            connector = self.connector_for(event)
+
+            if connector is None:
+                continue
+
+            if self.speed and first_time is not None:
+                wait = start + (event[TIME] - first_time) / self.speed - time.monotonic()
+
+                if wait > 0:
+                    await asyncio.sleep(wait)
+
+            if first_time is None:
+                first_time = event[TIME]
+
+            if STREAM in event:
+                task = self.replay_chunk(connector, event)
+
+                if task is not None:
+                    tasks.append(task)
+                    count += 1
+
+                continue
+
+            self.pending[event[DIRECTION]][event[SENDER]].append(time.monotonic())
+            tasks.append(asyncio.ensure_future(self.send(connector, event)))
+            count += 1
+
+        # the recording may end in the middle of a stream
+        for chunks in self.streams.values():
+            chunks.put_nowait(None)
+
+        self.streams.clear()
+
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        await self.drain()
+
+        undelivered = {
+            direction: sum(len(times) for times in pending.values())
+            for direction, pending in self.pending.items()
+        }
+
+        return ReplayReport(count, time.monotonic() - start, self.latencies, undelivered)
+
+    def connector_for(self, event):
+
+        if event.get(DIRECTION) == INBOUND:
+            return self.input_connector
+
+        if event.get(DIRECTION) == OUTBOUND:
+            return self.output_connector
+
+        return None
+
+    def replay_chunk(self, connector, event):
+
+        """
+        Sends a recorded chunk to its stream, and returns the task that
+        sends the stream when the chunk starts a new one.
+        """
+
+        stream_id = event[STREAM]
+        chunks = self.streams.get(stream_id)
+        task = None
+
+        if chunks is None:
+            if OUTPUT_MESSAGE not in event:
+                # the end of a stream that started before the recording
+                return None
+
+            chunks = self.streams[stream_id] = asyncio.Queue()
+            self.pending[event[DIRECTION]][event[SENDER]].append(time.monotonic())
+            task = asyncio.ensure_future(self.send_stream(connector, event[SENDER], chunks))
+
+        if OUTPUT_MESSAGE in event:
+            chunks.put_nowait(event[OUTPUT_MESSAGE].get('text'))
+        else:
+            chunks.put_nowait(None)
+            del self.streams[stream_id]
+
+        return task
+
+    async def send_stream(self, connector, recipient_id, chunks):
+
+        async def queued_chunks():
+            while True:
+                chunk = await chunks.get()
+
+                if chunk is None:
+                    return
+
+                yield chunk
+
+        try:
+            await connector.send_response_stream(recipient_id, queued_chunks())
+        except Exception:
+            logger.exception("Replayed stream failed")
+
+    async def send(self, connector, event):
+
+        try:
+            if event[DIRECTION] == INBOUND:
+                await connector.receive_user_message(connector.create_user_message(event))
+            else:
+                await connector.send_response(event[SENDER], dict(event[OUTPUT_MESSAGE]))
+        except Exception:
+            logger.exception("Replayed event failed")
+
+    async def drain(self):
+
+        """
+        Waits for messages held by middlewares (like the MessageCollector)
+        to be delivered.
+        """
+
+        deadline = time.monotonic() + self.drain_timeout
+
+        while time.monotonic() < deadline:
+            if not any(self.pending[INBOUND].values()) and not any(self.pending[OUTBOUND].values()):
+                return
+
+            await asyncio.sleep(0.05)
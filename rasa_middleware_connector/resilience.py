@@ -0,0 +1,346 @@
+import asyncio
+import contextvars
+import copy
+import logging
+import time
+
+from collections import OrderedDict
+from typing import Callable, Text, AsyncIterator, List, Optional
+
+from .middleware import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker:
+
+    """
+    Tracks the health of a pipeline stage.
+
+    The breaker starts CLOSED (calls go trough). After 'failure_threshold'
+    consecutive failures or slow calls it goes OPEN, and calls are refused
+    until 'reset_timeout' seconds have passed. Then it goes HALF_OPEN and
+    lets one trial call trough: a success closes the breaker again, a failure
+    opens it for another 'reset_timeout'.
+
+    Functions added with 'add_listener' are called as
+    'listener(name, old_state, new_state)' on every state transition.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: Text, failure_threshold: int = 5,
+                 slow_call_duration: Optional[float] = None, reset_timeout: float = 30.0):
+
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.slow_call_duration = slow_call_duration
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+
+        self.listeners = []
+
+    def add_listener(self, listener: Callable[[Text, Text, Text], None]):
+
+        self.listeners.append(listener)
+
+    def allow_call(self) -> bool:
+
+        """
+        Returns if a call to the protected stage should be attempted.
+        """
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                return False
+
+            self._transition(self.HALF_OPEN)
+
+        if self.state == self.HALF_OPEN:
+            # only one trial call at a time
+            if self.trial_running:
+                return False
+
+            self.trial_running = True
+
+        return True
+
+    def record_success(self, duration: float):
+
+        if self.slow_call_duration is not None and duration > self.slow_call_duration:
+            logger.warning(
+                "Stage {} was slow ({:.3f}s)".format(self.name, duration)
+            )
+            self.record_failure()
+            return
+
+        self.trial_running = False
+        self.failures = 0
+
+        if self.state != self.CLOSED:
+            self._transition(self.CLOSED)
+
+    def record_failure(self):
+
+        self.trial_running = False
+        self.failures += 1
+
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+            if self.state != self.OPEN:
+                self._transition(self.OPEN)
+
+    def _transition(self, new_state: Text):
+
+        old_state = self.state
+        self.state = new_state
+
+        logger.info(
+            "Circuit breaker {} changed from {} to {}".format(self.name, old_state, new_state)
+        )
+
+        for listener in self.listeners:
+            try:
+                listener(self.name, old_state, new_state)
+            except Exception:
+                logger.exception("Circuit breaker listener failed")
+
+
+class ResilientMiddleware(BaseMiddleware):
+
+    """
+    Wraps a middleware with a deadline, a circuit breaker and a fallback.
+
+    Only the work done by the wrapped middleware counts against the
+    deadline: the message it sends to 'next' is held until it returns, and
+    then forwarded. Messages sent to 'next' after the stage returned (like
+    the ones the MessageCollector sends when its timer fires) go straight
+    to the next middleware.
+
+    When the stage times out, raises an exception or the breaker is open,
+    the fallback is used:
+
+    * FALLBACK_SKIP: the message goes to the next middleware as it was
+      before the stage.
+    * FALLBACK_CACHED: the last successful result for the same key is
+      applied to the message, if there is none the stage is skipped.
+
+    Streams get the deadline and the breaker per chunk: each chunk goes
+    trough the wrapped middleware on its own, and when that fails the
+    original chunk is passed on.
+    """
+
+    FALLBACK_SKIP = 'skip'
+    FALLBACK_CACHED = 'cached'
+
+    def __init__(self, middleware: BaseMiddleware, timeout: Optional[float] = None,
+                 fallback: Text = FALLBACK_SKIP, breaker: Optional[CircuitBreaker] = None,
+                 cache_size: int = 1024, cache_key: Optional[Callable] = None):
+
+        super().__init__()
+
+        self.middleware = middleware
+        self.timeout = timeout
+        self.fallback = fallback
+        self.breaker = breaker or CircuitBreaker(type(middleware).__name__)
+        self.cache_size = cache_size
+        self.cache_key = cache_key or self.default_cache_key
+        self.cache = OrderedDict()
+
+        # holds the messages (or stream chunks) the wrapped middleware sent
+        # to 'next' (or 'next_stream') during the current call
+        self._captured = contextvars.ContextVar('captured', default=None)
+        self._captured_chunks = contextvars.ContextVar('captured_chunks', default=None)
+
+    def set_next(self, next, is_output):
+
+        super().set_next(next, is_output)
+        self.middleware.set_next(self._capture, is_output)
+
+    def set_next_stream(self, next_stream):
+
+        super().set_next_stream(next_stream)
+        self.middleware.set_next_stream(self._capture_stream)
+
+    def transfer_state(self, previous):
+
+        # wrappers are paired by their own class, so the cached results
+        # only belong to this stage when the wrapped middlewares match
+        if type(previous.middleware) is not type(self.middleware):
+            return
+
+        self.cache = previous.cache
+        self.middleware.transfer_state(previous.middleware)
+
+    async def _capture(self, *args):
+
+        captured = self._captured.get()
+
+        if captured is not None and captured['open']:
+            captured['messages'].append(args)
+        else:
+            await self.next(*args)
+
+    async def _capture_stream(self, recipient_id, chunks):
+
+        captured = self._captured_chunks.get()
+
+        if captured is None:
+            await self.next_stream(recipient_id, chunks)
+            return
+
+        async for chunk in chunks:
+            captured.append(chunk)
+
+    async def compute(self, *args):
+
+        if not self.breaker.allow_call():
+            logger.info("Stage {} is open, using fallback".format(self.breaker.name))
+            await self.run_fallback(args)
+            return
+
+        snapshot = self.snapshot(args)
+        captured = {'open': True, 'messages': []}
+        token = self._captured.set(captured)
+        start = time.monotonic()
+
+        try:
+            await asyncio.wait_for(self.middleware.compute(*args), self.timeout)
+        except asyncio.CancelledError:
+            # an Exception on Python 3.7, it is not a failure of the stage
+            raise
+        except asyncio.TimeoutError:
+            logger.error(
+                "Stage {} timed out after {}s".format(self.breaker.name, self.timeout)
+            )
+            self.breaker.record_failure()
+            await self.run_fallback(snapshot)
+            return
+        except Exception:
+            logger.exception("Stage {} failed".format(self.breaker.name))
+            self.breaker.record_failure()
+            await self.run_fallback(snapshot)
+            return
+        finally:
+            captured['open'] = False
+            self._captured.reset(token)
+
+        self.breaker.record_success(time.monotonic() - start)
+
+        for result in captured['messages']:
+            self.store_result(snapshot, result)
+            await self.next(*result)
+
+    async def output_stream_compute(self, recipient_id: Text, chunks: AsyncIterator[Text]):
+
+        async def resilient_chunks():
+            async for chunk in chunks:
+                for result in await self.compute_chunk(recipient_id, chunk):
+                    yield result
+
+        await self.next_stream(recipient_id, resilient_chunks())
+
+    async def compute_chunk(self, recipient_id: Text, chunk: Text) -> List[Text]:
+
+        """
+        Sends a single chunk trough the wrapped middleware and returns the
+        chunks it produced, or the original chunk on fallback.
+        """
+
+        if not self.breaker.allow_call():
+            return [chunk]
+
+        async def single_chunk():
+            yield chunk
+
+        captured = []
+        token = self._captured_chunks.set(captured)
+        start = time.monotonic()
+
+        try:
+            await asyncio.wait_for(
+                self.middleware.output_stream_compute(recipient_id, single_chunk()), self.timeout
+            )
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            logger.error(
+                "Stage {} timed out on a chunk after {}s".format(self.breaker.name, self.timeout)
+            )
+            self.breaker.record_failure()
+            return [chunk]
+        except Exception:
+            logger.exception("Stage {} failed on a chunk".format(self.breaker.name))
+            self.breaker.record_failure()
+            return [chunk]
+        finally:
+            self._captured_chunks.reset(token)
+
+        self.breaker.record_success(time.monotonic() - start)
+
+        return captured
+
+    def snapshot(self, args):
+
+        """
+        Copies the message before the stage runs, since middlewares
+        change it in place.
+        """
+
+        if self.is_output:
+            recipient_id, message = args
+            return recipient_id, copy.deepcopy(message)
+
+        return tuple(copy.copy(arg) for arg in args)
+
+    def default_cache_key(self, args):
+
+        if self.is_output:
+            recipient_id, message = args
+            return recipient_id, message.get('text')
+
+        message = args[0]
+        return message.sender_id, message.text
+
+    def store_result(self, snapshot, result):
+
+        if self.fallback != self.FALLBACK_CACHED:
+            return
+
+        key = self.cache_key(snapshot)
+        self.cache[key] = self.snapshot(result)
+        self.cache.move_to_end(key)
+
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def run_fallback(self, args):
+
+        if self.fallback == self.FALLBACK_CACHED:
+            cached = self.cache.get(self.cache_key(args))
+
+            if cached is not None:
+                logger.info("Stage {} served a cached result".format(self.breaker.name))
+                await self.next(*self.apply_cached(args, cached))
+                return
+
+        await self.next(*args)
+
+    def apply_cached(self, args, cached):
+
+        if self.is_output:
+            recipient_id, _ = args
+            return recipient_id, copy.deepcopy(cached[1])
+
+        message = args[0]
+        message.text = cached[0].text
+        message.metadata = cached[0].metadata
+
+        return (message, )
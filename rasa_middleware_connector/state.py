@@ -0,0 +1,333 @@
+import asyncio
+import json
+import sqlite3
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List, Text
+
+
+class StateBackend:
+
+    """
+    Interface for the storage of middleware state (like the messages held
+    by the MessageCollector or the language of each user).
+
+    Values are grouped by namespace and must be JSON serializable, so the
+    state can live outside of the process and be shared by several workers.
+    The methods are coroutines, so a networked store can be plugged in.
+    """
+
+    async def get(self, namespace: Text, key: Text, default: Any = None) -> Any:
+
+        raise NotImplementedError()
+
+    async def set(self, namespace: Text, key: Text, value: Any):
+
+        raise NotImplementedError()
+
+    async def set_immediate(self, namespace: Text, key: Text, value: Any):
+
+        """
+        Sets the value without batching it, for values other workers must
+        see right away.
+        """
+
+        await self.set(namespace, key, value)
+
+    async def delete(self, namespace: Text, key: Text):
+
+        raise NotImplementedError()
+
+    async def append(self, namespace: Text, key: Text, value: Any) -> int:
+
+        """
+        Appends a value to the list stored on the key and returns the new
+        length of the list. Must be atomic.
+        """
+
+        raise NotImplementedError()
+
+    async def pop_list(self, namespace: Text, key: Text) -> List:
+
+        """
+        Removes and returns the list stored on the key (an empty list if
+        there is none). Must be atomic: when several workers pop the same
+        key, only one gets the values.
+        """
+
+        raise NotImplementedError()
+
+    async def flush(self):
+
+        """
+        Writes any batched changes.
+        """
+
+        pass
+
+    async def close(self):
+
+        await self.flush()
+
+
+class InMemoryStateBackend(StateBackend):
+
+    """
+    Keeps the state in the process memory. It is the default, and only
+    works with a single worker.
+    """
+
+    def __init__(self):
+
+        self.values = {}
+        self.lists = {}
+
+    async def get(self, namespace, key, default=None):
+
+        return self.values.get((namespace, key), default)
+
+    async def set(self, namespace, key, value):
+
+        self.values[(namespace, key)] = value
+
+    async def delete(self, namespace, key):
+
+        self.values.pop((namespace, key), None)
+
+    async def append(self, namespace, key, value):
+
+        values = self.lists.setdefault((namespace, key), [])
+        values.append(value)
+
+        return len(values)
+
+    async def pop_list(self, namespace, key):
+
+        return self.lists.pop((namespace, key), [])
+
+
+class SQLiteStateBackend(StateBackend):
+
+    """
+    Keeps the state on a SQLite database in WAL mode, so every worker on the
+    same machine that opens the same file shares it.
+
+    'set' and 'delete' are batched: they are written when 'batch_size'
+    changes are pending, 'flush_interval' seconds passed since the last
+    write, or on 'flush'. Other workers may read the old value until then.
+    'append', 'pop_list' and 'set_immediate' are written immediately, since
+    they are used to hand messages over between workers.
+
+    sqlite3 calls block (up to 'busy_timeout' seconds while another worker
+    holds the write lock), so they run on a thread of their own instead of
+    on the event loop.
+    """
+
+    DELETED = object()
+    MISSING = object()
+
+    def __init__(self, path: Text, batch_size: int = 100, flush_interval: float = 0.5,
+                 busy_timeout: float = 5.0):
+
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pending = {}
+        self.last_flush = time.monotonic()
+        self.flush_handle = None
+
+        # a single thread, so the calls run in the order they were made
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-state')
+
+        # autocommit mode, transactions are opened explicitly
+        self.connection = sqlite3.connect(
+            path, timeout=busy_timeout, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS state_values ('
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+            'PRIMARY KEY (namespace, key))'
+        )
+        self.connection.execute(
+            'CREATE TABLE IF NOT EXISTS state_lists ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL)'
+        )
+        self.connection.execute(
+            'CREATE INDEX IF NOT EXISTS state_lists_key ON state_lists (namespace, key, id)'
+        )
+
+    async def get(self, namespace, key, default=None):
+
+        pending = self.pending.get((namespace, key), self.MISSING)
+
+        if pending is self.DELETED:
+            return default
+
+        if pending is not self.MISSING:
+            return pending
+
+        row = await self._run(self._select_value, namespace, key)
+
+        return default if row is None else json.loads(row[0])
+
+    async def set(self, namespace, key, value):
+
+        self.pending[(namespace, key)] = value
+        await self._flush_if_needed()
+
+    async def set_immediate(self, namespace, key, value):
+
+        # replaces the batched change of the key, if any
+        self.pending.pop((namespace, key), None)
+
+        await self._run(self._write_values, [(namespace, key, json.dumps(value))], [])
+
+    async def delete(self, namespace, key):
+
+        self.pending[(namespace, key)] = self.DELETED
+        await self._flush_if_needed()
+
+    async def append(self, namespace, key, value):
+
+        return await self._run(self._append, namespace, key, json.dumps(value))
+
+    async def pop_list(self, namespace, key):
+
+        rows = await self._run(self._pop_list, namespace, key)
+
+        return [json.loads(row[0]) for row in rows]
+
+    async def flush(self):
+
+        await self._write_pending()
+
+    async def close(self):
+
+        await self.flush()
+        await self._run(self.connection.close)
+        self.executor.shutdown(wait=False)
+
+    async def _run(self, function, *args):
+
+        return await asyncio.get_event_loop().run_in_executor(self.executor, function, *args)
+
+    async def _flush_if_needed(self):
+
+        if (len(self.pending) >= self.batch_size
+                or time.monotonic() - self.last_flush >= self.flush_interval):
+            await self._write_pending()
+
+        elif self.flush_handle is None:
+            # makes sure the batch is written even if no other change comes
+            self.flush_handle = asyncio.get_event_loop().call_later(
+                self.flush_interval, self._flush_later
+            )
+
+    def _flush_later(self):
+
+        self.flush_handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def _write_pending(self):
+
+        self.last_flush = time.monotonic()
+
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+
+        updates = [
+            (namespace, key, json.dumps(value))
+            for (namespace, key), value in pending.items() if value is not self.DELETED
+        ]
+        deletes = [
+            (namespace, key)
+            for (namespace, key), value in pending.items() if value is self.DELETED
+        ]
+
+        await self._run(self._write_values, updates, deletes)
+
+    # the methods below run on the executor thread
+
+    def _select_value(self, namespace, key):
+
+        return self.connection.execute(
+            'SELECT value FROM state_values WHERE namespace = ? AND key = ?',
+            (namespace, key)
+        ).fetchone()
+
+    def _append(self, namespace, key, value):
+
+        with self._transaction():
+            self.connection.execute(
+                'INSERT INTO state_lists (namespace, key, value) VALUES (?, ?, ?)',
+                (namespace, key, value)
+            )
+            row = self.connection.execute(
+                'SELECT COUNT(*) FROM state_lists WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            ).fetchone()
+
+        return row[0]
+
+    def _pop_list(self, namespace, key):
+
+        with self._transaction():
+            rows = self.connection.execute(
+                'SELECT value FROM state_lists WHERE namespace = ? AND key = ? ORDER BY id',
+                (namespace, key)
+            ).fetchall()
+            self.connection.execute(
+                'DELETE FROM state_lists WHERE namespace = ? AND key = ?',
+                (namespace, key)
+            )
+
+        return rows
+
+    def _write_values(self, updates, deletes):
+
+        with self._transaction():
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO state_values (namespace, key, value) VALUES (?, ?, ?)',
+                updates
+            )
+            self.connection.executemany(
+                'DELETE FROM state_values WHERE namespace = ? AND key = ?',
+                deletes
+            )
+
+    def _transaction(self):
+
+        return _Transaction(self.connection)
+
+
+class _Transaction:
+
+    def __init__(self, connection):
+
+        self.connection = connection
+
+    def __enter__(self):
+
+        # takes the write lock right away, so reads inside the transaction
+        # see the state other workers can not change
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, traceback):
+
+        if exc_type is None:
+            self.connection.execute('COMMIT')
+        else:
+            self.connection.execute('ROLLBACK')
+
+        return False
@@ -0,0 +1,28 @@
+import re
+
+from typing import Text, AsyncIterator, Iterable
+
+# a sentence ends on '.', '!', '?' or a line break, followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?\n])\s+')
+
+
+async def iterate_sentences(text: Text) -> AsyncIterator[Text]:
+
+    """
+    Splits a complete text into sentences and yields them one by one, 
+    so a full bot answer can be sent through the streaming output path.
+    """
+
+    for sentence in SENTENCE_BOUNDARY.split(text):
+        if sentence:
+            yield sentence
+
+
+async def iterate_chunks(chunks: Iterable[Text]) -> AsyncIterator[Text]:
+
+    """
+    Wraps a synchronous iterable of chunks in an async iterator.
+    """
+
+    for chunk in chunks:
+        yield chunk
@@ -8,7 +8,7 @@ with open(path.join(this_directory, 'README.md'), encoding='utf-8') as f:
 setup(
   name = 'rasa_middleware_connector',         # How you named your package folder (MyLib)
   packages = ['rasa_middleware_connector'],   # Chose the same as "name"
-  version = '0.2.1',      # Start with a small number and increase it with every change you make
+  version = '0.3.0',      # Start with a small number and increase it with every change you make
   license='MIT',        # Chose a license from here: https://help.github.com/articles/licensing-a-repository
   description = 'Adds middleware support for rasa connectors',   # Give a short description about your library
   long_description=long_description,
@@ -20,13 +20,12 @@ setup(
   install_requires=[            # I get to this in a second
           'rasa>=1.0',
       ],
+  python_requires='>=3.7',     # contextvars, time.thread_time and module __getattr__
   classifiers=[
     'Development Status :: 3 - Alpha',      # Chose either "3 - Alpha", "4 - Beta" or "5 - Production/Stable" as the current state of your package
     'Intended Audience :: Developers',      # Define that your audience are developers
     'Topic :: Software Development :: Build Tools',
     'License :: OSI Approved :: MIT License',   # Again, pick a license
-    'Programming Language :: Python :: 3.5', #Specify which pyhton versions that you want to support
-    'Programming Language :: Python :: 3.6',
-    'Programming Language :: Python :: 3.7',
+    'Programming Language :: Python :: 3.7', #Specify which pyhton versions that you want to support
   ],
 )
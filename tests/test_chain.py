@@ -0,0 +1,108 @@
+import asyncio
+
+from rasa_middleware_connector import (
+    BaseMiddleware, InputMiddlewareConnector, ResilientMiddleware, SimpleUserMessage
+)
+from rasa_middleware_connector.chain import transfer_states
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+class Counter(BaseMiddleware):
+
+    """
+    Counts the messages, the count is carried across reloads.
+    """
+
+    def __init__(self):
+
+        super().__init__()
+        self.count = 0
+
+    def transfer_state(self, previous):
+
+        self.count = previous.count
+
+    async def input_compute(self, message):
+
+        self.count += 1
+        await self.next(message)
+
+
+class Other(Counter):
+    pass
+
+
+class Input(InputMiddlewareConnector):
+
+    def __init__(self, middlewares):
+
+        self.middlewares = middlewares
+        self.received = []
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_on_new_message(self):
+
+        async def on_new_message(message):
+            self.received.append(message.text)
+
+        return on_new_message
+
+
+def test_wrappers_are_paired_by_the_wrapped_class():
+
+    counter, other = Counter(), Other()
+    counter.count, other.count = 1, 2
+
+    previous = [ResilientMiddleware(counter), ResilientMiddleware(other)]
+    previous[0].cache['key'] = 'counter'
+
+    # same stages, in a different order
+    middlewares = [ResilientMiddleware(Other()), ResilientMiddleware(Counter())]
+    transfer_states(previous, middlewares)
+
+    assert middlewares[0].middleware.count == 2
+    assert middlewares[1].middleware.count == 1
+    assert middlewares[1].cache['key'] == 'counter'
+    assert 'key' not in middlewares[0].cache
+
+
+def test_state_goes_to_a_middleware_that_is_now_wrapped():
+
+    previous = Counter()
+    previous.count = 3
+
+    wrapped = ResilientMiddleware(Counter())
+    transfer_states([previous], [wrapped])
+
+    assert wrapped.middleware.count == 3
+
+    unwrapped = Counter()
+    transfer_states([wrapped], [unwrapped])
+
+    assert unwrapped.count == 3
+
+
+def test_reload_keeps_the_state_and_uses_the_new_chain():
+
+    async def scenario():
+        connector = Input([Counter()])
+
+        await connector.receive_user_message(SimpleUserMessage('one', None, 'user'))
+
+        new_counter = Counter()
+        await connector.reload_middlewares([ResilientMiddleware(new_counter)])
+        await connector.receive_user_message(SimpleUserMessage('two', None, 'user'))
+
+        assert new_counter.count == 2
+        assert connector.received == ['one', 'two']
+
+    run(scenario())
@@ -0,0 +1,207 @@
+import asyncio
+
+import pytest
+
+from rasa_middleware_connector import BaseMiddleware, InputMiddlewareConnector, SimpleUserMessage
+from rasa_middleware_connector.lanes import hold_lane_tickets, lane_tickets
+from rasa_middleware_connector.state import InMemoryStateBackend
+
+from examples.socket_connector.custom_middlewares.message_collector import MessageCollector
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+class Input(InputMiddlewareConnector):
+
+    use_priority_lanes = True
+
+    def __init__(self, middlewares, bulk_lane_concurrency=16):
+
+        self.middlewares = middlewares
+        self.bulk_lane_concurrency = bulk_lane_concurrency
+        self.received = []
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_on_new_message(self):
+
+        async def on_new_message(message):
+            self.received.append(message.text)
+
+        return on_new_message
+
+    def bulk_metrics(self):
+
+        return self.lane_metrics[self.BULK_LANE]
+
+    def free_bulk_slots(self):
+
+        return self.bulk_lane._value
+
+
+class Failing(BaseMiddleware):
+
+    """
+    Raises on every message, after holding it when 'hold' is set.
+    """
+
+    def __init__(self, hold=False):
+
+        super().__init__()
+        self.hold = hold
+
+    async def input_compute(self, message):
+
+        if self.hold:
+            hold_lane_tickets(message)
+
+        raise RuntimeError(message.text)
+
+
+class Holder(BaseMiddleware):
+
+    """
+    Holds the messages and sends them merged on 'flush'.
+    """
+
+    def __init__(self):
+
+        super().__init__()
+        self.held = []
+
+    async def input_compute(self, message):
+
+        hold_lane_tickets(message)
+        self.held.append(message)
+
+    async def flush(self):
+
+        merged = self.held[0]
+        merged.text = ' '.join(message.text for message in self.held)
+        merged.lane_tickets = [
+            ticket for message in self.held for ticket in lane_tickets(message)
+        ]
+        self.held = []
+
+        await self.next(merged)
+
+
+class Blocking(BaseMiddleware):
+
+    def __init__(self):
+
+        super().__init__()
+        self.running = 0
+        self.unblock = asyncio.Event()
+
+    async def input_compute(self, message):
+
+        self.running += 1
+        await self.unblock.wait()
+        await self.next(message)
+
+
+def message(text, sender_id='user'):
+
+    return SimpleUserMessage(text, None, sender_id)
+
+
+@pytest.mark.parametrize('hold', [False, True])
+def test_ticket_is_released_when_the_chain_fails(hold):
+
+    async def scenario():
+        connector = Input([Failing(hold)], bulk_lane_concurrency=1)
+
+        for _ in range(2):
+            # a leaked slot would block the second message
+            with pytest.raises(RuntimeError):
+                await asyncio.wait_for(
+                    connector.receive_user_message(message('a long message')), 1
+                )
+
+        assert connector.bulk_metrics().count == 2
+        assert connector.free_bulk_slots() == 1
+
+    run(scenario())
+
+
+def test_held_tickets_are_released_when_the_merged_message_reaches_rasa():
+
+    async def scenario():
+        holder = Holder()
+        connector = Input([holder])
+
+        await connector.receive_user_message(message('a long message'))
+        await connector.receive_user_message(message('another long message'))
+
+        # both messages are still on the lane
+        assert connector.bulk_metrics().count == 0
+        assert connector.free_bulk_slots() == 14
+
+        await holder.flush()
+
+        assert connector.received == ['a long message another long message']
+        assert connector.bulk_metrics().count == 2
+        assert connector.free_bulk_slots() == 16
+
+    run(scenario())
+
+
+def test_collector_releases_the_tickets_of_combined_messages(monkeypatch):
+
+    monkeypatch.setenv('DELAY_TIME', '0.05')
+
+    async def scenario():
+        connector = Input([MessageCollector(None, InMemoryStateBackend())])
+
+        await connector.receive_user_message(message('a long message'))
+        await asyncio.sleep(0.02)
+        await connector.receive_user_message(message('another long message'))
+        await connector.receive_user_message(message('and a last one'))
+
+        assert connector.free_bulk_slots() == 14
+
+        await asyncio.sleep(0.1)
+
+        assert connector.received == [
+            'a long message', 'another long message and a last one'
+        ]
+        assert connector.bulk_metrics().count == 3
+        assert connector.free_bulk_slots() == 16
+
+    run(scenario())
+
+
+def test_bulk_lane_concurrency_blocks_the_messages_over_the_limit():
+
+    async def scenario():
+        blocking = Blocking()
+        connector = Input([blocking], bulk_lane_concurrency=2)
+
+        tasks = [
+            asyncio.ensure_future(connector.receive_user_message(message('a long message')))
+            for _ in range(3)
+        ]
+        await asyncio.sleep(0.01)
+
+        assert blocking.running == 2
+
+        # fast messages skip the bulk lane
+        await connector.receive_user_message(message('/command'))
+        assert connector.received == ['/command']
+
+        blocking.unblock.set()
+        await asyncio.gather(*tasks)
+
+        assert blocking.running == 3
+        assert len(connector.received) == 4
+        assert connector.free_bulk_slots() == 2
+
+    run(scenario())
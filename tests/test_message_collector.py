@@ -0,0 +1,162 @@
+import asyncio
+
+import pytest
+
+from rasa_middleware_connector import InputMiddlewareConnector, SimpleUserMessage
+from rasa_middleware_connector.state import InMemoryStateBackend, SQLiteStateBackend
+
+from examples.socket_connector.custom_middlewares.message_collector import (
+    MessageCollector, MessageHandler
+)
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(autouse=True)
+def short_delay(monkeypatch):
+
+    monkeypatch.setenv('DELAY_TIME', '0.05')
+
+
+class Input(InputMiddlewareConnector):
+
+    def __init__(self, middlewares):
+
+        self.middlewares = middlewares
+        self.received = []
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_on_new_message(self):
+
+        async def on_new_message(message):
+            self.received.append(message.text)
+
+        return on_new_message
+
+
+class FlakyBackend(InMemoryStateBackend):
+
+    """
+    Fails the calls named on 'failing' on the given namespace.
+    """
+
+    def __init__(self, namespace, *failing):
+
+        super().__init__()
+        self.namespace = namespace
+        self.failing = set(failing)
+
+    def check(self, call, namespace):
+
+        if call in self.failing and namespace == self.namespace:
+            raise RuntimeError(call)
+
+    async def get(self, namespace, key, default=None):
+
+        self.check('get', namespace)
+        return await super().get(namespace, key, default)
+
+    async def set_immediate(self, namespace, key, value):
+
+        self.check('set_immediate', namespace)
+        await super().set_immediate(namespace, key, value)
+
+    async def append(self, namespace, key, value):
+
+        self.check('append', namespace)
+        return await super().append(namespace, key, value)
+
+
+def message(text):
+
+    return SimpleUserMessage(text, None, 'user')
+
+
+def test_messages_during_the_delay_are_combined():
+
+    async def scenario():
+        connector = Input([MessageCollector(None, InMemoryStateBackend())])
+
+        # the first message of a user skips the delay
+        await connector.receive_user_message(message('hello'))
+        await asyncio.sleep(0.02)
+
+        for text in ('how', 'are', 'you'):
+            await connector.receive_user_message(message(text))
+
+        await asyncio.sleep(0.1)
+
+        assert connector.received == ['hello', 'how are you']
+
+    run(scenario())
+
+
+def test_messages_are_sent_when_the_deadline_can_not_be_read():
+
+    async def scenario():
+        backend = FlakyBackend(MessageHandler.DEADLINE_NAMESPACE, 'set_immediate')
+        connector = Input([MessageCollector(None, backend)])
+
+        await connector.receive_user_message(message('hello'))
+        await asyncio.sleep(0.02)
+
+        backend.failing.add('get')
+        await connector.receive_user_message(message('again'))
+        await asyncio.sleep(0.1)
+
+        assert connector.received == ['hello', 'again']
+
+    run(scenario())
+
+
+def test_handler_that_failed_to_start_is_not_kept():
+
+    async def scenario():
+        backend = FlakyBackend(MessageHandler.STATE_NAMESPACE, 'append')
+        collector = MessageCollector(None, backend)
+        connector = Input([collector])
+
+        with pytest.raises(RuntimeError):
+            await connector.receive_user_message(message('lost'))
+
+        assert 'user' not in collector.handlers
+
+        backend.failing.clear()
+        await connector.receive_user_message(message('hello'))
+        await asyncio.sleep(0.1)
+
+        assert connector.received == ['hello']
+
+    run(scenario())
+
+
+def test_deadline_is_shared_without_flush_and_cleared_after_sending(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        backend = SQLiteStateBackend(path, batch_size=100, flush_interval=0.01)
+        other = SQLiteStateBackend(path)
+        connector = Input([MessageCollector(None, backend)])
+
+        await connector.receive_user_message(message('hello'))
+
+        assert backend.pending == {}
+        assert await other.get(MessageHandler.DEADLINE_NAMESPACE, 'user') is not None
+
+        await asyncio.sleep(0.1)
+
+        assert connector.received == ['hello']
+        assert await other.get(MessageHandler.DEADLINE_NAMESPACE, 'user') is None
+
+        await backend.close()
+        await other.close()
+
+    run(scenario())
@@ -0,0 +1,52 @@
+import asyncio
+import json
+
+from rasa_middleware_connector.recording import RecorderMiddleware, TrafficRecorder
+from rasa_middleware_connector.replay import (
+    ReplayInputConnector, ReplayOutputConnector, TrafficReplayer
+)
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+async def chunks_of(*chunks):
+
+    for chunk in chunks:
+        yield chunk
+
+
+def test_recorded_stream_is_replayed_as_a_stream(tmp_path):
+
+    path = str(tmp_path / 'traffic.jsonl')
+
+    async def record():
+        recorder = TrafficRecorder(path)
+        connector = ReplayOutputConnector([RecorderMiddleware(recorder)])
+
+        await connector.send_response_stream('user', chunks_of('one', 'two', 'three'))
+        await connector.send_response('user', {'text': 'single'})
+        recorder.close()
+
+    run(record())
+
+    with open(path) as recording:
+        events = [json.loads(line) for line in recording]
+
+    # three chunks, the end of the stream and the single message
+    assert len(events) == 5
+    assert [event.get('i') for event in events[:4]] == [0, 1, 2, 3]
+
+    async def replay():
+        output_connector = ReplayOutputConnector([])
+        replayer = TrafficReplayer(ReplayInputConnector([]), output_connector, speed=None)
+
+        report = await replayer.replay(events)
+
+        # the stream arrives once, with every chunk
+        assert report.events == 2
+        assert output_connector.sent == 4
+
+    run(replay())
@@ -0,0 +1,220 @@
+import asyncio
+
+from rasa_middleware_connector import (
+    BaseMiddleware, CircuitBreaker, InputMiddlewareConnector, OutputMiddlewareConnector,
+    ResilientMiddleware, SimpleUserMessage
+)
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+class Channel:
+
+    def __init__(self):
+
+        self.sent = []
+
+    async def send_response(self, recipient_id, message):
+
+        self.sent.append(message['text'])
+
+    async def send_text_message(self, recipient_id, text, **kwargs):
+
+        self.sent.append(text)
+
+
+class Output(OutputMiddlewareConnector, Channel):
+
+    def __init__(self, middlewares):
+
+        self.middlewares = middlewares
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_connector_class(self):
+
+        return OutputMiddlewareConnector
+
+
+class Input(InputMiddlewareConnector):
+
+    def __init__(self, middlewares):
+
+        self.middlewares = middlewares
+        self.received = []
+
+        super().__init__()
+
+    def get_middlewares(self):
+
+        return self.middlewares
+
+    def get_on_new_message(self):
+
+        async def on_new_message(message):
+            self.received.append(message.text)
+
+        return on_new_message
+
+
+class Upper(BaseMiddleware):
+
+    """
+    Upper cases the text, hangs on 'hang' and fails on 'fail'.
+    """
+
+    def __init__(self):
+
+        super().__init__()
+        self.calls = 0
+
+    async def transform(self, text):
+
+        self.calls += 1
+
+        if 'hang' in text:
+            await asyncio.sleep(10)
+
+        if 'fail' in text:
+            raise RuntimeError(text)
+
+        return text.upper()
+
+    async def input_compute(self, message):
+
+        message.text = await self.transform(message.text)
+        await self.next(message)
+
+    async def output_compute(self, recipient_id, message):
+
+        message['text'] = await self.transform(message['text'])
+        await self.next(recipient_id, message)
+
+    async def output_stream_compute(self, recipient_id, chunks):
+
+        async def transformed():
+            async for chunk in chunks:
+                yield await self.transform(chunk)
+
+        await self.next_stream(recipient_id, transformed())
+
+
+async def chunks_of(*chunks):
+
+    for chunk in chunks:
+        yield chunk
+
+
+def test_timeout_and_error_skip_the_stage():
+
+    async def scenario():
+        connector = Input([ResilientMiddleware(Upper(), timeout=0.05)])
+
+        for text in ('ok', 'hang', 'fail'):
+            await connector.receive_user_message(SimpleUserMessage(text, None, 'user'))
+
+        assert connector.received == ['OK', 'hang', 'fail']
+
+    run(scenario())
+
+
+def test_cached_fallback_serves_the_last_result():
+
+    async def scenario():
+        upper = Upper()
+        connector = Input([ResilientMiddleware(upper, fallback=ResilientMiddleware.FALLBACK_CACHED)])
+
+        await connector.receive_user_message(SimpleUserMessage('hello', None, 'user'))
+
+        async def broken(text):
+            raise RuntimeError(text)
+
+        upper.transform = broken
+        await connector.receive_user_message(SimpleUserMessage('hello', None, 'user'))
+        await connector.receive_user_message(SimpleUserMessage('other', None, 'user'))
+
+        assert connector.received == ['HELLO', 'HELLO', 'other']
+
+    run(scenario())
+
+
+def test_open_breaker_skips_the_stage_until_reset():
+
+    async def scenario():
+        upper = Upper()
+        breaker = CircuitBreaker('upper', failure_threshold=2, reset_timeout=0.1)
+        transitions = []
+        breaker.add_listener(lambda name, old, new: transitions.append(new))
+
+        connector = Input([ResilientMiddleware(upper, breaker=breaker)])
+
+        for text in ('fail', 'fail', 'skipped'):
+            await connector.receive_user_message(SimpleUserMessage(text, None, 'user'))
+
+        assert upper.calls == 2
+        assert connector.received == ['fail', 'fail', 'skipped']
+
+        await asyncio.sleep(0.15)
+        await connector.receive_user_message(SimpleUserMessage('trial', None, 'user'))
+
+        assert connector.received[-1] == 'TRIAL'
+        assert transitions == [breaker.OPEN, breaker.HALF_OPEN, breaker.CLOSED]
+
+    run(scenario())
+
+
+def test_cancelled_stage_is_not_a_failure():
+
+    async def scenario():
+        upper = Upper()
+        breaker = CircuitBreaker('upper', failure_threshold=1)
+        connector = Input([ResilientMiddleware(upper, breaker=breaker)])
+
+        task = asyncio.ensure_future(
+            connector.receive_user_message(SimpleUserMessage('hang', None, 'user'))
+        )
+        await asyncio.sleep(0.01)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+        assert breaker.state == breaker.CLOSED
+        assert connector.received == []
+
+    run(scenario())
+
+
+def test_stream_chunks_have_a_deadline_and_fallback():
+
+    async def scenario():
+        connector = Output([ResilientMiddleware(Upper(), timeout=0.05)])
+
+        await connector.send_response_stream('user', chunks_of('one', 'hang', 'fail', 'two'))
+
+        assert connector.sent == ['ONE', 'hang', 'fail', 'TWO']
+
+    run(scenario())
+
+
+def test_cache_is_only_transferred_between_the_same_stage():
+
+    class Other(Upper):
+        pass
+
+    previous = ResilientMiddleware(Upper())
+    previous.cache['key'] = 'upper'
+
+    same = ResilientMiddleware(Upper())
+    same.transfer_state(previous)
+
+    different = ResilientMiddleware(Other())
+    different.transfer_state(previous)
+
+    assert same.cache['key'] == 'upper'
+    assert 'key' not in different.cache
@@ -0,0 +1,220 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from rasa_middleware_connector.state import InMemoryStateBackend, SQLiteStateBackend
+
+
+def run(coroutine):
+
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_backend(request, tmp_path):
+
+    def make():
+
+        if request.param == 'memory':
+            return InMemoryStateBackend()
+
+        return SQLiteStateBackend(str(tmp_path / 'state.db'))
+
+    return make
+
+
+def test_get_set_delete(make_backend):
+
+    async def scenario():
+        backend = make_backend()
+
+        assert await backend.get('ns', 'key') is None
+        assert await backend.get('ns', 'key', 'default') == 'default'
+
+        await backend.set('ns', 'key', {'a': [1, 2]})
+        assert await backend.get('ns', 'key') == {'a': [1, 2]}
+        assert await backend.get('other', 'key') is None
+
+        await backend.delete('ns', 'key')
+        assert await backend.get('ns', 'key', 'default') == 'default'
+
+        # deleting a missing key is not an error
+        await backend.delete('ns', 'missing')
+
+        await backend.close()
+
+    run(scenario())
+
+
+def test_append_returns_the_new_length(make_backend):
+
+    async def scenario():
+        backend = make_backend()
+
+        assert await backend.append('ns', 'key', 'a') == 1
+        assert await backend.append('ns', 'key', ['b', 'c']) == 2
+        assert await backend.append('ns', 'other', 'd') == 1
+
+        await backend.close()
+
+    run(scenario())
+
+
+def test_pop_list_returns_the_values_in_order_and_removes_them(make_backend):
+
+    async def scenario():
+        backend = make_backend()
+
+        for value in ('a', ['b', 'c'], 'd'):
+            await backend.append('ns', 'key', value)
+
+        assert await backend.pop_list('ns', 'key') == ['a', ['b', 'c'], 'd']
+        assert await backend.pop_list('ns', 'key') == []
+        assert await backend.pop_list('ns', 'missing') == []
+        assert await backend.append('ns', 'key', 'e') == 1
+
+        await backend.close()
+
+    run(scenario())
+
+
+def test_sqlite_batched_values_are_shared_after_flush(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        first = SQLiteStateBackend(path, batch_size=100, flush_interval=60)
+        second = SQLiteStateBackend(path)
+
+        await first.set('ns', 'key', 'value')
+        assert await first.get('ns', 'key') == 'value'
+        assert await second.get('ns', 'key') is None
+
+        await first.flush()
+        assert await second.get('ns', 'key') == 'value'
+
+        await first.delete('ns', 'key')
+        await first.flush()
+        assert await second.get('ns', 'key') is None
+
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+def test_sqlite_set_immediate_is_shared_and_replaces_the_batched_value(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        first = SQLiteStateBackend(path, batch_size=100, flush_interval=60)
+        second = SQLiteStateBackend(path)
+
+        await first.set('ns', 'key', 'batched')
+        await first.set_immediate('ns', 'key', 'immediate')
+        assert await second.get('ns', 'key') == 'immediate'
+
+        # the batched value is not written over it later
+        await first.flush()
+        assert await second.get('ns', 'key') == 'immediate'
+
+        await first.close()
+        await second.close()
+
+    run(scenario())
+
+
+def test_sqlite_concurrent_appends_are_not_lost(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        workers = [SQLiteStateBackend(path) for _ in range(3)]
+
+        lengths = await asyncio.gather(*(
+            worker.append('ns', 'key', '{}-{}'.format(index, value))
+            for value in range(30)
+            for index, worker in enumerate(workers)
+        ))
+
+        # every append saw a different length
+        assert sorted(lengths) == list(range(1, 91))
+
+        values = await workers[0].pop_list('ns', 'key')
+        assert sorted(values) == sorted(
+            '{}-{}'.format(index, value) for index in range(3) for value in range(30)
+        )
+
+        for worker in workers:
+            await worker.close()
+
+    run(scenario())
+
+
+def test_sqlite_concurrent_pops_get_each_value_once(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        workers = [SQLiteStateBackend(path) for _ in range(3)]
+        appended = []
+        popped = []
+
+        async def produce(worker, index):
+            for value in range(20):
+                appended.append('{}-{}'.format(index, value))
+                await worker.append('ns', 'key', appended[-1])
+
+        async def consume(worker):
+            for _ in range(20):
+                popped.extend(await worker.pop_list('ns', 'key'))
+
+        await asyncio.gather(
+            *(produce(worker, index) for index, worker in enumerate(workers)),
+            *(consume(worker) for worker in workers)
+        )
+        popped.extend(await workers[0].pop_list('ns', 'key'))
+
+        assert len(popped) == len(set(popped))
+        assert sorted(popped) == sorted(appended)
+
+        for worker in workers:
+            await worker.close()
+
+    run(scenario())
+
+
+def test_sqlite_waiting_for_the_lock_does_not_block_the_loop(tmp_path):
+
+    async def scenario():
+        path = str(tmp_path / 'state.db')
+        backend = SQLiteStateBackend(path, busy_timeout=5.0)
+
+        # another worker holds the write lock
+        other = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        other.execute('BEGIN IMMEDIATE')
+
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticking = asyncio.ensure_future(ticker())
+        append = asyncio.ensure_future(backend.append('ns', 'key', 'value'))
+
+        await asyncio.sleep(0.2)
+        assert not append.done()
+        assert ticks >= 10
+
+        other.execute('COMMIT')
+        assert await asyncio.wait_for(append, 5) == 1
+
+        ticking.cancel()
+        other.close()
+        await backend.close()
+
+    start = time.monotonic()
+    run(scenario())
+    assert time.monotonic() - start < 5
@@ -0,0 +1,15 @@
+from examples.socket_connector.custom_middlewares.text_cleaner import TextNormalizer
+
+
+def test_expressions_and_characters_are_replaced():
+
+    normalizer = TextNormalizer()
+
+    assert normalizer.tokenize('Olá, tá bom?') == ['ola', 'esta', 'bom']
+
+
+def test_only_single_character_replacements():
+
+    normalizer = TextNormalizer({'a': ['á']})
+
+    assert normalizer.normalize(' Olá, tudo? ') == 'ola tudo'